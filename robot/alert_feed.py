@@ -0,0 +1,52 @@
+"""Change feed for the alert queue.
+
+Every queue change is published with a monotonically increasing sequence
+number. Clients fetch only the changes after the last sequence they saw
+(`/alerts/changes?since=`) or follow them live over Server-Sent Events
+(`/alerts/stream`). `epoch` changes on each server start, so a client whose
+sequence belongs to an earlier run knows to reload the full queue.
+"""
+import threading, uuid
+from collections import deque
+
+
+class ChangeFeed:
+    def __init__(self, retain=5000):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.seq = 0
+        self._log = deque(maxlen=retain)
+        self._cond = threading.Condition()
+
+    @property
+    def etag(self):
+        return f'"{self.epoch}-{self.seq}"'
+
+    def publish(self, op, patient_id=None, entry=None):
+        """Record one change ("upsert", "remove" or "clear") and wake waiting streams."""
+        with self._cond:
+            self.seq += 1
+            change = {"seq": self.seq, "op": op}
+            if patient_id is not None:
+                change["patient_id"] = patient_id
+            if entry is not None:
+                change["entry"] = entry
+            self._log.append(change)
+            self._cond.notify_all()
+            return self.seq
+
+    def since(self, seq, epoch=None):
+        """Changes after `seq`, or None if the client must reload the full queue."""
+        with self._cond:
+            if epoch != self.epoch or seq > self.seq:
+                return None
+            if seq == self.seq:
+                return []
+            if not self._log or self._log[0]["seq"] > seq + 1:
+                return None   # older changes have already been dropped
+            return [c for c in self._log if c["seq"] > seq]
+
+    def wait(self, seq, timeout):
+        """Block until there are changes after `seq` (or timeout); return them."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq > seq, timeout=timeout)
+            return [c for c in self._log if c["seq"] > seq]
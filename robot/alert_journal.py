@@ -0,0 +1,76 @@
+"""Append-only journal for the alert queue.
+
+Every change is appended to a JSON Lines log as one small record, so an
+alert costs one short write no matter how long the queue is. Every
+`compact_every` records the full queue is written to the snapshot file
+(the readable critical_alerts.json) through a temp file and an atomic
+rename, and the log is truncated. At startup the snapshot is loaded and
+the log replayed on top; a torn last line from a crash is ignored.
+"""
+import json, os
+
+
+class AlertJournal:
+    def __init__(self, snapshot_path, journal_path=None, compact_every=500, fsync=True):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path or snapshot_path + ".log"
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.pending = 0
+        self._log = None
+
+    def _open(self):
+        if self._log is None:
+            self._log = open(self.journal_path, "a", encoding="utf-8")
+        return self._log
+
+    def append(self, op, **fields):
+        """Record one change, e.g. append("add", entry={...}) or append("clear")."""
+        self.append_many([dict(fields, op=op)])
+
+    def append_many(self, records):
+        """Record several changes with a single flush/fsync."""
+        log = self._open()
+        for record in records:
+            log.write(json.dumps(record, separators=(",", ":")) + "\n")
+        log.flush()
+        if self.fsync:
+            os.fsync(log.fileno())
+        self.pending += len(records)
+
+    def needs_compaction(self):
+        return self.pending >= self.compact_every
+
+    def replay(self):
+        """Return (snapshot entries, journal records) as stored on disk."""
+        entries = []
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        records = []
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # torn write from a crash; nothing after it is trustworthy
+                        print(f"[JOURNAL] Ignoring truncated record in {self.journal_path}")
+                        break
+        self.pending = len(records)
+        return entries, records
+
+    def compact(self, entries):
+        """Write `entries` as the new snapshot and start an empty log."""
+        tmp = self.snapshot_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entries, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        open(self.journal_path, "w").close()
+        self.pending = 0
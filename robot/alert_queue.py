@@ -0,0 +1,125 @@
+"""Indexed priority queue of alerts, one live alert per patient.
+
+Alerts are ordered by score (highest first), then by arrival, so equal
+scores never fall back to comparing the alert dicts. A position index keyed
+by patient_id finds a patient's alert in O(1), and the heap update behind
+upsert, acknowledge and remove is O(log n); peek is O(1).
+
+A sorted copy of the heap keys is kept alongside for sorted_view(). Each
+change locates its slot with bisect in O(log n), but inserting into or
+deleting from the Python list shifts the elements after it, so the change
+as a whole is O(n). That is a single memmove of pointers, far cheaper than
+re-sorting the queue on every read for the queue sizes a care home has.
+The view and its JSON rendering are cached, so polling /alerts does not
+re-sort or re-serialize an unchanged queue.
+"""
+import bisect, itertools, json
+
+
+class AlertQueue:
+    def __init__(self):
+        self._heap = []          # [(-score, seq, patient_id)]
+        self._pos = {}           # patient_id -> index in _heap
+        self._entries = {}       # patient_id -> alert dict
+        self._order = []         # same keys as the heap, kept sorted
+        self._seq = itertools.count()
+        self.version = 0
+        self._view = None
+        self._json = None
+
+    # ---- heap internals ----
+    def _swap(self, i, j):
+        heap = self._heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self._pos[heap[i][2]] = i
+        self._pos[heap[j][2]] = j
+
+    def _sift_up(self, i):
+        while i > 0:
+            parent = (i - 1) // 2
+            if self._heap[i] >= self._heap[parent]:
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, i):
+        n = len(self._heap)
+        while True:
+            smallest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < n and self._heap[child] < self._heap[smallest]:
+                    smallest = child
+            if smallest == i:
+                return
+            self._swap(i, smallest)
+            i = smallest
+
+    def _remove_key(self, patient_id):
+        i = self._pos.pop(patient_id)
+        key = self._heap[i]
+        last = self._heap.pop()
+        if i < len(self._heap):
+            self._heap[i] = last
+            self._pos[last[2]] = i
+            self._sift_up(i)
+            self._sift_down(self._pos[last[2]])
+        del self._order[bisect.bisect_left(self._order, key)]
+
+    def _changed(self):
+        self.version += 1
+        self._view = None
+        self._json = None
+
+    # ---- public API ----
+    def upsert(self, entry):
+        """Insert or replace the alert for entry["patient_id"]; O(n) with the sorted copy."""
+        patient_id = entry["patient_id"]
+        if patient_id in self._pos:
+            self._remove_key(patient_id)
+        key = (-int(entry.get("score", 0)), next(self._seq), patient_id)
+        self._entries[patient_id] = entry
+        self._heap.append(key)
+        self._pos[patient_id] = len(self._heap) - 1
+        self._sift_up(len(self._heap) - 1)
+        bisect.insort(self._order, key)
+        self._changed()
+
+    def remove(self, patient_id):
+        """Drop a patient's alert (e.g. acknowledged); returns it, or None. O(n), like upsert."""
+        if patient_id not in self._pos:
+            return None
+        self._remove_key(patient_id)
+        self._changed()
+        return self._entries.pop(patient_id)
+
+    def clear(self):
+        self._heap.clear()
+        self._pos.clear()
+        self._entries.clear()
+        self._order.clear()
+        self._changed()
+
+    def peek(self):
+        """Highest-priority alert, or None."""
+        return self._entries[self._heap[0][2]] if self._heap else None
+
+    def get(self, patient_id):
+        return self._entries.get(patient_id)
+
+    def __contains__(self, patient_id):
+        return patient_id in self._pos
+
+    def __len__(self):
+        return len(self._heap)
+
+    def sorted_view(self):
+        """Alerts highest score first; cached until the queue changes."""
+        if self._view is None:
+            self._view = [self._entries[key[2]] for key in self._order]
+        return self._view
+
+    def sorted_json(self):
+        """sorted_view() rendered as JSON; cached until the queue changes."""
+        if self._json is None:
+            self._json = json.dumps(self.sorted_view())
+        return self._json
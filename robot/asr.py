@@ -0,0 +1,146 @@
+"""Streaming speech capture with voice-activity endpointing for the robot.
+
+One recorder process (arecord or sox `rec`) runs for the whole session and
+streams raw 16 kHz mono PCM to a reader thread. Audio is only kept while
+`listen()` is active, so the robot never hears itself between questions.
+`listen()` feeds a single reusable KaldiRecognizer and returns as soon as
+the resident stops talking:
+
+  - no speech within `start_timeout` seconds -> ""
+  - speech followed by `end_silence` seconds of quiet (low RMS energy and
+    no new Vosk partial text) -> the recognized text
+  - `max_seconds` of audio -> whatever was recognized so far
+"""
+import json, queue, subprocess, threading, time
+from shutil import which
+import numpy as np
+from vosk import KaldiRecognizer
+
+SAMPLE_RATE = 16000
+# 50 ms of 16-bit mono audio per read
+CHUNK_BYTES = SAMPLE_RATE * 2 // 20
+
+
+def recorder_command(sample_rate=SAMPLE_RATE):
+    """Command that streams raw S16_LE mono PCM to stdout, or None if no recorder is installed."""
+    if which("arecord"):
+        return ["arecord", "-q", "-t", "raw", "-f", "S16_LE", "-r", str(sample_rate), "-c", "1"]
+    if which("rec"):
+        return ["rec", "-q", "-c", "1", "-b", "16", "-r", str(sample_rate),
+                "-e", "signed-integer", "-t", "raw", "-"]
+    return None
+
+
+def rms(chunk):
+    samples = np.frombuffer(chunk, dtype="<i2").astype(np.float32)
+    return float(np.sqrt(np.mean(samples * samples))) if len(samples) else 0.0
+
+
+class SpeechListener:
+    """Keeps one audio stream and one recognizer alive across questions."""
+
+    def __init__(self, model, sample_rate=SAMPLE_RATE, rms_threshold=500,
+                 start_timeout=6.0, end_silence=0.8, max_seconds=15.0, command=None):
+        self.sample_rate = sample_rate
+        self.rms_threshold = rms_threshold
+        self.start_timeout = start_timeout
+        self.end_silence = end_silence
+        self.max_seconds = max_seconds
+        self.command = command or recorder_command(sample_rate)
+        self.recognizer = KaldiRecognizer(model, sample_rate)
+        self._chunks = queue.Queue()
+        self._listening = threading.Event()
+        self._proc = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return self.command is not None
+
+    def _ensure_stream(self):
+        """Start (or restart, if it died) the recorder and its reader thread."""
+        with self._lock:
+            if self._proc is not None and self._proc.poll() is None:
+                return
+            self._proc = subprocess.Popen(self.command, stdout=subprocess.PIPE,
+                                          stderr=subprocess.DEVNULL)
+            threading.Thread(target=self._read, args=(self._proc,), daemon=True).start()
+
+    def _read(self, proc):
+        # buffered reads return whole chunks, so samples never straddle two reads
+        while True:
+            data = proc.stdout.read(CHUNK_BYTES)
+            if not data:
+                self._chunks.put(None)   # recorder exited
+                return
+            if self._listening.is_set():
+                self._chunks.put(data)
+
+    def _drain(self):
+        while True:
+            try:
+                self._chunks.get_nowait()
+            except queue.Empty:
+                return
+
+    def listen(self):
+        """Capture one utterance and return its text ("" if nobody spoke)."""
+        self._ensure_stream()
+        self.recognizer.Reset()
+        self._drain()
+        self._listening.set()
+        try:
+            return self._endpoint()
+        finally:
+            self._listening.clear()
+
+    def _endpoint(self):
+        rec = self.recognizer
+        parts = []
+        heard = 0.0             # seconds of audio consumed
+        speech_started = None   # audio time of first speech
+        last_voice = 0.0        # audio time of the last loud chunk or new partial
+        partial = ""
+        deadline = time.monotonic() + self.start_timeout + self.max_seconds
+
+        while heard < self.max_seconds and time.monotonic() < deadline:
+            try:
+                data = self._chunks.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            if data is None:
+                break
+            heard += len(data) / (2 * self.sample_rate)
+
+            if rec.AcceptWaveform(data):
+                text = json.loads(rec.Result()).get("text", "")
+                if text:
+                    parts.append(text)
+                    last_voice = heard
+                partial = ""
+            else:
+                current = json.loads(rec.PartialResult()).get("partial", "")
+                if current != partial:
+                    partial = current
+                    last_voice = heard
+            if rms(data) >= self.rms_threshold:
+                last_voice = heard
+
+            if speech_started is None:
+                if last_voice > 0 and (partial or parts):
+                    speech_started = last_voice
+                elif heard >= self.start_timeout:
+                    break
+            elif heard - last_voice >= self.end_silence:
+                break
+
+        final = json.loads(rec.FinalResult()).get("text", "")
+        if final:
+            parts.append(final)
+        return " ".join(parts).strip()
+
+    def close(self):
+        with self._lock:
+            if self._proc is not None and self._proc.poll() is None:
+                self._proc.terminate()
+            self._proc = None
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Asyncio triage server for serving many robots from one host.
+
+Same /triage and /stats API as ollama_triage_server.py, but served by
+aiohttp: the event loop handles connections while blocking engine turns run
+on a worker pool, and the engine's InferenceQueue caps concurrent LLM calls.
+
+    TRIAGE_LLM_CONCURRENCY=2 python async_triage_server.py
+"""
+import asyncio, os
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+from llm_backends import LLM_BACKEND, LLM_CONCURRENCY, OLLAMA_MODEL, make_backend
+from prescreen import run_batch
+from session_store import make_session_store
+from triage_engine import TriageEngine
+
+# threads for turns in flight; turns beyond LLM_CONCURRENCY wait in the inference queue
+WORKERS = int(os.environ.get("TRIAGE_WORKERS", "32"))
+
+_END = object()
+
+
+async def iterate_in_thread(gen, executor):
+    """Drive a blocking generator on `executor`, yielding its items on the event loop."""
+    loop = asyncio.get_running_loop()
+    items = asyncio.Queue()
+
+    def pump():
+        try:
+            for item in gen:
+                loop.call_soon_threadsafe(items.put_nowait, item)
+        finally:
+            loop.call_soon_threadsafe(items.put_nowait, _END)
+
+    done = loop.run_in_executor(executor, pump)
+    while True:
+        item = await items.get()
+        if item is _END:
+            break
+        yield item
+    await done
+
+
+async def triage(request):
+    engine, executor = request.app["engine"], request.app["executor"]
+    data = await request.json()
+    problem = engine.request_problem(data)
+    if problem:
+        return web.json_response({"status": "error", "msg": problem}, status=400)
+
+    if data.get("stream") or request.query.get("stream"):
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream",
+                                           "Cache-Control": "no-cache"})
+        await resp.prepare(request)
+        async for event in iterate_in_thread(engine.stream_turn(data), executor):
+            await resp.write(event.encode("utf-8"))
+        await resp.write_eof()
+        return resp
+
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(executor, engine.turn, data)
+    # the LLM backend failed; the session is kept so the client can retry the answer
+    return web.json_response(result, status=502 if "error" in result else 200)
+
+
+async def triage_batch(request):
+    """EHR-only verdicts for many patients, streamed as NDJSON as they complete."""
+    engine, executor = request.app["engine"], request.app["executor"]
+    data = await request.json()
+    patient_ids = [str(pid) for pid in data.get("patient_ids", [])]
+    if not patient_ids:
+        return web.json_response({"status": "error", "msg": "No patient_ids given"}, status=400)
+
+    resp = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await resp.prepare(request)
+    lines = run_batch(engine, patient_ids, LLM_CONCURRENCY, push=data.get("push_alerts", True))
+    async for line in iterate_in_thread(lines, executor):
+        await resp.write(line.encode("utf-8"))
+    await resp.write_eof()
+    return resp
+
+
+async def stats(request):
+    """Active sessions and inference queue depth."""
+    return web.json_response(request.app["engine"].stats())
+
+
+def make_app(backend=None):
+    backend = backend or make_backend(LLM_BACKEND, OLLAMA_MODEL)
+    app = web.Application()
+    app["engine"] = TriageEngine(backend, concurrency=LLM_CONCURRENCY,
+                                 sessions=make_session_store())
+    app["executor"] = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="triage")
+    app.router.add_post("/triage", triage)
+    app.router.add_post("/triage/batch", triage_batch)
+    app.router.add_get("/stats", stats)
+
+    async def warm(app):
+        try:
+            await asyncio.get_running_loop().run_in_executor(app["executor"], backend.warm)
+        except Exception as e:
+            print("[LLM] Warm-up failed:", e)
+
+    async def shutdown(app):
+        app["executor"].shutdown(wait=False)
+
+    app.on_startup.append(warm)
+    app.on_cleanup.append(shutdown)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(make_app(), host="0.0.0.0", port=8000)
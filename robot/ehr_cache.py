@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""Binary column cache for the parsed Synthea tables.
+
+Each table is stored under `.ehr_cache/` next to its CSV as one .npy file per
+column plus a small JSON manifest. Numeric, datetime and categorical-code
+columns are memory-mapped on load. The manifest records the source CSV's
+size and mtime (and optionally its SHA-1) so a changed CSV is re-parsed
+automatically.
+
+Column files are never overwritten: every rebuild writes a new generation
+of files and then swaps in a manifest pointing at it, so processes that
+still have the old columns memory-mapped keep reading them undisturbed.
+Older generations are unlinked once the new manifest is in place.
+
+Warm the cache ahead of time with:
+
+    python ehr_cache.py --data-dir /path/to/synthea
+"""
+import argparse, hashlib, json, os, uuid
+import numpy as np
+import pandas as pd
+
+CACHE_DIRNAME = ".ehr_cache"
+CACHE_VERSION = 2
+
+
+def file_sha1(path, block_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_stamp(path, use_hash=False):
+    """Identify a source file by size and mtime, plus content hash if asked."""
+    st = os.stat(path)
+    stamp = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if use_hash:
+        stamp["sha1"] = file_sha1(path)
+    return stamp
+
+
+def _stamp_matches(saved, path, use_hash):
+    current = source_stamp(path)
+    if saved.get("size") == current["size"] and saved.get("mtime_ns") == current["mtime_ns"]:
+        return True
+    # mtime changed (e.g. file copied during deploy) but contents may not have
+    return use_hash and saved.get("size") == current["size"] \
+        and saved.get("sha1") == file_sha1(path)
+
+
+def _manifest_path(cache_dir, name):
+    return os.path.join(cache_dir, f"{name}.json")
+
+
+def _column_path(cache_dir, name, generation, column, part):
+    return os.path.join(cache_dir, f"{name}.{generation}.{column}.{part}.npy")
+
+
+def _remove_old_generations(cache_dir, name, keep=None):
+    """Unlink `name`'s column files except generation `keep`; mapped readers keep their copy."""
+    current = f"{name}.{keep}." if keep else None
+    for fn in os.listdir(cache_dir):
+        if fn.startswith(f"{name}.") and fn.endswith(".npy") \
+                and not (current and fn.startswith(current)):
+            try:
+                os.remove(os.path.join(cache_dir, fn))
+            except OSError:
+                pass
+
+
+def prune(cache_dir):
+    """Unlink column files that no manifest refers to (old generations, dropped variants)."""
+    keep = set()
+    for fn in os.listdir(cache_dir):
+        if fn.endswith(".json"):
+            try:
+                with open(os.path.join(cache_dir, fn)) as f:
+                    keep.add(f"{fn[:-len('.json')]}.{json.load(f).get('generation')}.")
+            except (OSError, ValueError):
+                continue
+    for fn in os.listdir(cache_dir):
+        if fn.endswith(".npy") and not any(fn.startswith(prefix) for prefix in keep):
+            try:
+                os.remove(os.path.join(cache_dir, fn))
+            except OSError:
+                pass
+
+
+def save_table(df, cache_dir, name, stamp):
+    """Write `df` as a new generation of column files, then commit it with the manifest."""
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = _manifest_path(cache_dir, name)
+    generation = uuid.uuid4().hex[:12]
+
+    def save(col, part, values):
+        np.save(_column_path(cache_dir, name, generation, col, part), values)
+
+    columns = []
+    for col in df.columns:
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            kind = "category"
+            save(col, "codes", series.cat.codes.to_numpy())
+            save(col, "categories", series.cat.categories.astype(str).to_numpy(dtype="U"))
+        elif pd.api.types.is_datetime64_any_dtype(series) or pd.api.types.is_numeric_dtype(series):
+            kind = "array"
+            save(col, "values", series.to_numpy())
+        else:
+            kind = "string"
+            save(col, "values", series.fillna("").astype(str).to_numpy(dtype="U"))
+            save(col, "isna", series.isna().to_numpy())
+        columns.append({"name": col, "kind": kind})
+
+    tmp = f"{manifest}.{generation}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"version": CACHE_VERSION, "source": stamp, "generation": generation,
+                   "columns": columns}, f)
+    os.replace(tmp, manifest)
+    _remove_old_generations(cache_dir, name, keep=generation)
+
+
+def load_table(cache_dir, name, source_path, columns, use_hash=False):
+    """Return the cached table, or None if it is missing, stale or lacks `columns`."""
+    try:
+        with open(_manifest_path(cache_dir, name)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != CACHE_VERSION:
+        return None
+    if not _stamp_matches(manifest.get("source", {}), source_path, use_hash):
+        return None
+    stored = {c["name"]: c["kind"] for c in manifest["columns"]}
+    if not set(columns) <= set(stored):
+        return None
+
+    generation = manifest.get("generation")
+    path = lambda col, part: _column_path(cache_dir, name, generation, col, part)
+    data = {}
+    try:
+        for col, kind in stored.items():
+            if kind == "category":
+                codes = np.load(path(col, "codes"), mmap_mode="r")
+                categories = np.load(path(col, "categories"))
+                data[col] = pd.Categorical.from_codes(codes, categories=categories.astype(object))
+            elif kind == "array":
+                data[col] = np.load(path(col, "values"), mmap_mode="r")
+            else:
+                values = np.load(path(col, "values")).astype(object)
+                values[np.load(path(col, "isna"))] = None
+                data[col] = values
+    except (OSError, ValueError) as e:
+        print(f"[EHR cache] {name} unreadable, rebuilding: {e}")
+        return None
+    return pd.DataFrame(data, copy=False)
+
+
+def cached_table(source_path, name, columns, build, cache_dir=None, use_hash=False):
+    """Load `name` from the cache, or call `build()` and cache its result."""
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(source_path), CACHE_DIRNAME)
+    if not os.path.exists(source_path):
+        return build()
+    df = load_table(cache_dir, name, source_path, columns, use_hash)
+    if df is not None:
+        return df
+    stamp = source_stamp(source_path, use_hash)
+    df = build()
+    try:
+        save_table(df, cache_dir, name, stamp)
+    except OSError as e:
+        print(f"[EHR cache] could not write {name}: {e}")
+    return df
+
+
+def main():
+    from ehr_parser import DATA_DIR, EHRLoader
+
+    parser = argparse.ArgumentParser(description="Build the binary EHR cache ahead of time.")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="directory holding the Synthea CSVs")
+    parser.add_argument("--hash", action="store_true", help="also record SHA-1 of each CSV")
+    parser.add_argument("--force", action="store_true", help="rebuild even if the cache is fresh")
+    args = parser.parse_args()
+
+    cache_dir = os.path.join(args.data_dir, CACHE_DIRNAME)
+    if args.force:
+        # drop the manifests so every table is rebuilt into a new generation; the old
+        # column files are unlinked (never overwritten) once each new manifest is in place
+        for fn in os.listdir(cache_dir) if os.path.isdir(cache_dir) else []:
+            if fn.endswith(".json"):
+                os.remove(os.path.join(cache_dir, fn))
+
+    ehr = EHRLoader(args.data_dir, use_cache=True, cache_hash=args.hash)
+    for table in ("patients", "observations", "conditions"):
+        print(f"[EHR cache] {table}: {len(getattr(ehr, table))} rows")
+    if args.force and os.path.isdir(cache_dir):
+        prune(cache_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,278 @@
+import hashlib, os, threading
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
+import ehr_cache
 
 
-# load Synthea CSVs
-patients_df = pd.read_csv("patients.csv")
-observations_df = pd.read_csv("observations.csv")
-conditions_df = pd.read_csv("conditions.csv")
-
-# demographic info!
-patients_df['BIRTHDATE'] = pd.to_datetime(patients_df['BIRTHDATE'])
+# Synthea CSVs live next to this file unless told otherwise
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
 today = pd.to_datetime("today")
-patients_df['age'] = (today - patients_df['BIRTHDATE']).dt.days // 365
+
+# Only the columns get_patient_context actually reads
+PATIENT_COLUMNS = ["Id", "BIRTHDATE", "FIRST", "LAST", "GENDER", "RACE", "ETHNICITY"]
+OBSERVATION_COLUMNS = ["DATE", "PATIENT", "DESCRIPTION", "VALUE"]
+CONDITION_COLUMNS = ["PATIENT", "DESCRIPTION", "STOP"]
+TABLE_DTYPES = {"Id": str, "PATIENT": str, "DESCRIPTION": "category"}
+
+# Keep only relevant measurements
+RELEVANT_CODES = [
+    "Body mass index (BMI) [Ratio]",
+    "Systolic Blood Pressure",
+    "Diastolic Blood Pressure",
+    "Heart rate",
+    "Respiratory rate",
+    "Hemoglobin [Mass/volume] in Blood",
+    "Platelets [#/volume] in Blood by Automated count"
+]
+LOOKBACK_YEARS = 3
+# rows per chunk when streaming observations.csv; bounds peak memory
+CHUNK_ROWS = 250_000
+# rough upper bound on a rendered context, in tokens (see estimate_tokens)
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("EHR_CONTEXT_TOKEN_BUDGET", "400"))
+# relative change of the latest reading vs. earlier ones that counts as a trend
+TREND_TOLERANCE = 0.05
+
+
+def _group_offsets(keys):
+    """Map each value of an already-sorted column to its (start, stop) row range."""
+    values = keys.to_numpy()
+    if len(values) == 0:
+        return {}
+    starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+    stops = np.r_[starts[1:], len(values)]
+    return {values[s]: (int(s), int(e)) for s, e in zip(starts, stops)}
+
+
+class PatientStore:
+    """Synthea tables indexed by patient Id.
+
+    Built once: observations and conditions are sorted by patient so each
+    patient owns one contiguous row range, DATE is parsed up front and
+    DESCRIPTION is stored as categorical codes. A lookup then only touches
+    that patient's rows instead of scanning whole tables.
+    """
+
+    def __init__(self, patients, observations, conditions):
+        self.patients = patients.reset_index(drop=True)
+        self.patient_rows = {pid: i for i, pid in enumerate(self.patients["Id"].astype(str))}
+
+        obs = observations[["PATIENT", "DATE", "DESCRIPTION", "VALUE"]].copy()
+        obs["PATIENT"] = obs["PATIENT"].astype(str)
+        obs["DATE"] = pd.to_datetime(obs["DATE"], utc=True).dt.tz_localize(None)
+        obs["DESCRIPTION"] = obs["DESCRIPTION"].astype("category")
+        obs = obs.sort_values(["PATIENT", "DATE"], kind="stable").reset_index(drop=True)
+        self.obs_offsets = _group_offsets(obs["PATIENT"])
+        self.obs_patients = obs["PATIENT"].to_numpy()
+        self.obs_dates = obs["DATE"].to_numpy()
+        self.obs_codes = obs["DESCRIPTION"].cat.codes.to_numpy()
+        self.obs_code_names = obs["DESCRIPTION"].cat.categories
+        self.obs_values = obs["VALUE"].to_numpy()
+
+        cond = conditions[["PATIENT", "DESCRIPTION"]].copy()
+        cond["PATIENT"] = cond["PATIENT"].astype(str)
+        # a condition is active until its STOP date passes; no STOP means ongoing
+        if "STOP" in conditions:
+            stop = pd.to_datetime(conditions["STOP"], utc=True, errors="coerce").dt.tz_localize(None)
+            cond["ACTIVE"] = stop.isna() | (stop >= today)
+        else:
+            cond["ACTIVE"] = True
+        cond = cond.sort_values("PATIENT", kind="stable").reset_index(drop=True)
+        self.cond_offsets = _group_offsets(cond["PATIENT"])
+        self.cond_patients = cond["PATIENT"].to_numpy()
+        self.cond_descriptions = cond["DESCRIPTION"].to_numpy()
+        self.cond_active = cond["ACTIVE"].to_numpy(dtype=bool)
+
+    def code_ids(self, descriptions):
+        """Translate DESCRIPTION strings to categorical codes, dropping unknown ones."""
+        ids = self.obs_code_names.get_indexer(descriptions)
+        return ids[ids >= 0]
+
+    def patient(self, patient_id):
+        row = self.patient_rows.get(str(patient_id))
+        return None if row is None else self.patients.iloc[row]
+
+    def observations(self, patient_id, code_ids=None, since=None):
+        """Return (description, value, date) tuples for one patient, oldest first."""
+        start, stop = self.obs_offsets.get(str(patient_id), (0, 0))
+        dates = self.obs_dates[start:stop]
+        codes = self.obs_codes[start:stop]
+        mask = codes >= 0
+        if since is not None:
+            mask &= dates >= pd.Timestamp(since).to_datetime64()
+        if code_ids is not None:
+            mask &= np.isin(codes, code_ids)
+        names = self.obs_code_names
+        values = self.obs_values[start:stop]
+        return [(names[codes[i]], values[i], dates[i]) for i in np.flatnonzero(mask)]
+
+    def conditions(self, patient_id, active_only=False):
+        """Return the patient's unique condition descriptions in record order."""
+        start, stop = self.cond_offsets.get(str(patient_id), (0, 0))
+        descriptions = self.cond_descriptions[start:stop]
+        if active_only:
+            descriptions = descriptions[self.cond_active[start:stop]]
+        return list(pd.unique(descriptions))
+
+
+def read_table(path, columns):
+    """Read only `columns` from a CSV; a missing file gives an empty table."""
+    if not os.path.exists(path):
+        print(f"[EHR] {path} not found, using empty table")
+        return pd.DataFrame({c: pd.Series(dtype=TABLE_DTYPES.get(c, object)) for c in columns})
+    wanted = set(columns)
+    dtypes = {c: t for c, t in TABLE_DTYPES.items() if c in wanted}
+    return pd.read_csv(path, usecols=lambda c: c in wanted, dtype=dtypes)
+
+
+def stream_observations(path, codes=RELEVANT_CODES, lookback_years=LOOKBACK_YEARS,
+                        chunksize=CHUNK_ROWS):
+    """Read observations.csv in chunks, keeping only `codes` inside the lookback window.
+
+    Peak memory is one raw chunk plus the kept vitals, however large the
+    export is. DESCRIPTION comes back as a categorical over `codes`.
+    """
+    code_type = pd.CategoricalDtype(list(codes))
+    empty = pd.DataFrame({
+        "DATE": pd.Series(dtype="datetime64[ns]"), "PATIENT": pd.Series(dtype=str),
+        "DESCRIPTION": pd.Series(dtype=code_type), "VALUE": pd.Series(dtype=object),
+    })
+    if not os.path.exists(path):
+        print(f"[EHR] {path} not found, using empty table")
+        return empty
+
+    cutoff = today - pd.DateOffset(years=lookback_years)
+    wanted = set(OBSERVATION_COLUMNS)
+    kept = []
+    reader = pd.read_csv(path, usecols=lambda c: c in wanted, chunksize=chunksize,
+                         dtype={"PATIENT": str, "DESCRIPTION": str, "VALUE": str})
+    for chunk in reader:
+        # cheap string filter first so only vitals pay for date parsing
+        chunk = chunk[chunk["DESCRIPTION"].isin(code_type.categories)]
+        dates = pd.to_datetime(chunk["DATE"], utc=True).dt.tz_localize(None)
+        chunk = chunk.assign(DATE=dates)[dates >= cutoff]
+        kept.append(chunk.astype({"DESCRIPTION": code_type}))
+    if not kept:
+        return empty
+    return pd.concat(kept, ignore_index=True)[OBSERVATION_COLUMNS]
+
+
+class EHRLoader:
+    """Lazily loads the Synthea tables from `data_dir`.
+
+    Nothing touches disk until a table is first used, so importing this
+    module is free and a missing CSV only matters once it is needed.
+    Parsed tables are kept in the binary cache (see ehr_cache) unless
+    `use_cache` is off.
+
+    Observations are streamed (see stream_observations) so only
+    `vital_codes` within `lookback_years` are ever held in memory; pass
+    `stream=False` to load the full table instead.
+
+    Rendered contexts are capped at roughly `token_budget` tokens (None
+    for no cap).
+    """
+
+    def __init__(self, data_dir=DATA_DIR, use_cache=True, cache_hash=False,
+                 vital_codes=RELEVANT_CODES, lookback_years=LOOKBACK_YEARS,
+                 stream=True, chunksize=CHUNK_ROWS, token_budget=CONTEXT_TOKEN_BUDGET):
+        self.data_dir = data_dir
+        self.use_cache = use_cache
+        self.cache_hash = cache_hash
+        self.vital_codes = list(vital_codes)
+        self.lookback_years = lookback_years
+        self.stream = stream
+        self.chunksize = chunksize
+        self.token_budget = token_budget
+        # first use may come from several threads (e.g. background precompute)
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        """Forget loaded tables so the next use re-reads them."""
+        with self._lock:
+            self._patients = None
+            self._observations = None
+            self._conditions = None
+            self._store = None
+
+    def path(self, filename):
+        return os.path.join(self.data_dir, filename)
+
+    def data_version(self):
+        """Size/mtime stamp of the source CSVs; changes whenever one of them does."""
+        version = []
+        for filename in ("patients.csv", "observations.csv", "conditions.csv"):
+            try:
+                st = os.stat(self.path(filename))
+                version.append((st.st_size, st.st_mtime_ns))
+            except OSError:
+                version.append(None)
+        return tuple(version)
+
+    def _load(self, filename, columns, parse_dates=(), build=None, name=None):
+        path = self.path(filename)
+
+        def read():
+            df = read_table(path, columns)
+            for col in parse_dates:
+                df[col] = pd.to_datetime(df[col], utc=True).dt.tz_localize(None)
+            return df
+
+        build = build or read
+        if not self.use_cache:
+            return build()
+        name = name or os.path.splitext(filename)[0]
+        return ehr_cache.cached_table(path, name, columns, build, use_hash=self.cache_hash)
+
+    @property
+    def patients(self):
+        with self._lock:
+            return self._load_patients()
+
+    def _load_patients(self):
+        if self._patients is None:
+            df = self._load("patients.csv", PATIENT_COLUMNS, parse_dates=["BIRTHDATE"])
+            # demographic info! (depends on today, so never cached)
+            df["age"] = (today - df["BIRTHDATE"]).dt.days // 365
+            self._patients = df
+        return self._patients
+
+    @property
+    def observations(self):
+        with self._lock:
+            return self._load_observations()
+
+    def _load_observations(self):
+        if self._observations is None:
+            if self.stream:
+                # the filtered table depends on the code list and window, so cache it per variant
+                variant = hashlib.sha1(repr((self.vital_codes, self.lookback_years)).encode()).hexdigest()[:10]
+                self._observations = self._load(
+                    "observations.csv", OBSERVATION_COLUMNS, name=f"observations-{variant}",
+                    build=lambda: stream_observations(self.path("observations.csv"), self.vital_codes,
+                                                      self.lookback_years, self.chunksize))
+            else:
+                self._observations = self._load("observations.csv", OBSERVATION_COLUMNS, parse_dates=["DATE"])
+        return self._observations
+
+    @property
+    def conditions(self):
+        with self._lock:
+            if self._conditions is None:
+                self._conditions = self._load("conditions.csv", CONDITION_COLUMNS)
+            return self._conditions
+
+    @property
+    def store(self):
+        with self._lock:
+            if self._store is None:
+                self._store = PatientStore(self.patients, self.observations, self.conditions)
+            return self._store
+
+
+# Default loader used by the module-level helpers
+loader = EHRLoader()
 
 # Helper function to format patient's name
 def get_full_name(patient_row):
@@ -17,65 +280,306 @@ def get_full_name(patient_row):
     last = patient_row.get('LAST', '')
     return f"{first} {last}".strip() or "Unknown"
 
-def get_patient_context(patient_id):
-    # Make sure that patient_id is a string 
+def estimate_tokens(text):
+    """Rough prompt token count: about four characters per token for English text."""
+    return (len(text) + 3) // 4
+
+
+def _vital_line(description, latest, latest_value, date, low, high, count, total):
+    """Summarize one vital as its latest reading plus range and trend over the window."""
+    day = pd.Timestamp(date).strftime("%Y-%m-%d")
+    if np.isnan(latest_value):
+        return f"{description}: latest {latest} ({day})"
+    line = f"{description}: latest {latest_value:g} ({day})"
+    if count < 2:
+        return line
+    # compare the latest reading against the mean of the earlier ones
+    previous = (total - latest_value) / (count - 1)
+    change = latest_value - previous
+    if abs(change) <= TREND_TOLERANCE * abs(previous):
+        trend = "stable"
+    else:
+        trend = "rising" if change > 0 else "falling"
+    return f"{line}, range {low:g}-{high:g} over {count} readings, {trend}"
+
+
+def _reading_age(entry):
+    """Sort key for a (date, line) vitals entry: oldest reading first, undated before all."""
+    date = pd.Timestamp(entry[0])
+    return pd.Timestamp.min if pd.isna(date) else date
+
+
+def _render_context(header, years, vitals, conditions, token_budget):
+    """Fill the summary template, dropping the oldest details until it fits `token_budget`.
+
+    `vitals` is a list of (latest reading date, line) and `conditions` is in
+    record order, oldest first. Conditions go first, oldest first, then
+    vitals lines by the age of their latest reading. Only if that is still
+    not enough is the text cut, at a line break.
+    """
+    def render(shown_vitals, shown_conditions):
+        if not vitals:
+            vitals_text = f"No relevant vitals recorded in the past {years} years"
+        else:
+            hidden = len(vitals) - len(shown_vitals)
+            vitals_text = "; ".join([line for _, line in shown_vitals]
+                                    + ([f"+{hidden} older"] if hidden else []))
+        if not conditions:
+            listed = "No active conditions recorded"
+        else:
+            hidden = len(conditions) - len(shown_conditions)
+            listed = ", ".join(shown_conditions + ([f"+{hidden} older"] if hidden else []))
+        return f"{header}\n\nVitals (last {years} years): {vitals_text}\nActive conditions: {listed}"
+
+    shown_vitals, shown_conditions = list(vitals), list(conditions)
+    context = render(shown_vitals, shown_conditions)
+    if token_budget is None:
+        return context
+    while shown_conditions and estimate_tokens(context) > token_budget:
+        shown_conditions.pop(0)
+        context = render(shown_vitals, shown_conditions)
+    while shown_vitals and estimate_tokens(context) > token_budget:
+        shown_vitals.remove(min(shown_vitals, key=_reading_age))
+        context = render(shown_vitals, shown_conditions)
+    limit = token_budget * 4
+    if len(context) > limit:
+        # only a tiny budget gets here; keep whole lines of the header
+        cut = context.rfind("\n", 0, limit + 1)
+        context = context[:cut] if cut > 0 else context[:limit]
+    return context
+
+
+def get_patient_context(patient_id, ehr=None):
+    # Make sure that patient_id is a string
     patient_id = str(patient_id)
-    
-    patient = patients_df.loc[patients_df["Id"] == patient_id]
-    if patient.empty:
+    ehr = ehr or loader
+    store = ehr.store
+
+    patient = store.patient(patient_id)
+    if patient is None:
         return f"No patient found with ID {patient_id}"
-    patient = patient.iloc[0]
-    
+
     name = get_full_name(patient)
     age = patient.get("age", "Unknown")
     gender = patient.get("GENDER", "Unknown")
     race = patient.get("RACE", "Unknown")
     ethnicity = patient.get("ETHNICITY", "Unknown")
-    
+    header = f"Patient Summary:\nName: {name}\nAge: {age}, Gender: {gender}, Race: {race}, Ethnicity: {ethnicity}"
+
     # Filter by year!!
-    patient_obs = observations_df[observations_df["PATIENT"] == patient_id].copy()
-    patient_obs['DATE'] = pd.to_datetime(patient_obs['DATE']).dt.tz_localize(None)
-    
-    three_years_ago = today - pd.DateOffset(years=3)
-    recent_obs = patient_obs[patient_obs['DATE'] >= three_years_ago]
-    
-    # Keep only relevant measurements
-    relevant_codes = [
-        "Body mass index (BMI) [Ratio]",
-        "Systolic Blood Pressure",
-        "Diastolic Blood Pressure",
-        "Heart rate",
-        "Respiratory rate",
-        "Hemoglobin [Mass/volume] in Blood",
-        "Platelets [#/volume] in Blood by Automated count"
+    years = ehr.lookback_years
+    cutoff = today - pd.DateOffset(years=years)
+    recent_obs = store.observations(patient_id, store.code_ids(ehr.vital_codes), since=cutoff)
+
+    # one line per vital instead of every reading
+    lines = []
+    for code in ehr.vital_codes:
+        rows = [(value, date) for description, value, date in recent_obs if description == code]
+        if not rows:
+            continue
+        values = pd.to_numeric(pd.Series([value for value, _ in rows], dtype=object), errors="coerce")
+        numeric = values.dropna()
+        lines.append((rows[-1][1], _vital_line(code, rows[-1][0], float(values.iloc[-1]), rows[-1][1],
+                                               numeric.min(), numeric.max(), len(numeric), numeric.sum())))
+
+    patient_conditions = store.conditions(patient_id, active_only=True)
+    return _render_context(header, years, lines, patient_conditions, ehr.token_budget)
+
+
+def _run_starts(keys):
+    """Start offsets of each run of equal values in an already-grouped array."""
+    if len(keys) == 0:
+        return np.array([], dtype=int)
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+
+def _split_runs(keys, items):
+    """Group `items` into lists by contiguous runs of `keys`, as a Series indexed by key."""
+    starts = _run_starts(keys)
+    if len(starts) == 0:
+        return pd.Series(dtype=object)
+    ends = np.r_[starts[1:], len(keys)]
+    return pd.Series([items[a:b] for a, b in zip(starts, ends)], index=keys[starts], dtype=object)
+
+
+def _text_column(df, column, default):
+    if column not in df:
+        return pd.Series(default, index=df.index)
+    return df[column].astype(str)
+
+
+def bulk_patient_summaries(ehr=None, patient_ids=None):
+    """Build summaries for many patients at once with vectorized table operations.
+
+    Returns a DataFrame indexed by patient Id with the name, demographics,
+    one column per vital code holding its latest value in the lookback
+    window, the unique active `conditions`, the rendered `context` (which
+    matches get_patient_context for the same patient) and its estimated
+    `tokens`. Restrict it to `patient_ids` (unknown ids are dropped) or
+    leave None for everyone.
+    """
+    ehr = ehr or loader
+    store = ehr.store
+    years = ehr.lookback_years
+    cutoff = (today - pd.DateOffset(years=years)).to_datetime64()
+
+    patients = store.patients.assign(Id=store.patients["Id"].astype(str))
+    # patient() resolves duplicate ids to the last row
+    patients = patients.drop_duplicates("Id", keep="last")
+    if patient_ids is not None:
+        patients = patients[patients["Id"].isin([str(pid) for pid in patient_ids])]
+    patients = patients.set_index("Id")
+    wanted = patients.index.to_numpy()
+
+    summaries = pd.DataFrame(index=patients.index)
+    name = (_text_column(patients, "FIRST", "") + " " + _text_column(patients, "LAST", "")).str.strip()
+    summaries["name"] = name.mask(name == "", "Unknown")
+    summaries["age"] = patients["age"] if "age" in patients else "Unknown"
+    for column in ("GENDER", "RACE", "ETHNICITY"):
+        summaries[column.lower()] = _text_column(patients, column, "Unknown")
+
+    # Vitals: rows are sorted by (patient, date), so each group's last row is its latest
+    mask = np.isin(store.obs_codes, store.code_ids(ehr.vital_codes)) & (store.obs_dates >= cutoff)
+    if patient_ids is not None:
+        mask &= pd.Series(store.obs_patients).isin(wanted).to_numpy()
+    names = np.asarray(store.obs_code_names, dtype=object)
+    obs = pd.DataFrame({
+        "patient": store.obs_patients[mask],
+        "code": names[store.obs_codes[mask]],
+        "value": store.obs_values[mask],
+        "date": store.obs_dates[mask],
+    })
+    obs["number"] = pd.to_numeric(obs["value"], errors="coerce")
+    stats = obs.groupby(["patient", "code"], sort=False)["number"].agg(["min", "max", "count", "sum"])
+    latest = obs.drop_duplicates(["patient", "code"], keep="last").set_index(["patient", "code"])
+    stats = stats.join(latest[["value", "number", "date"]])
+    # lay each patient's vitals out in vital_codes order
+    rank = {code: i for i, code in enumerate(ehr.vital_codes)}
+    stats = stats.reset_index()
+    stats = stats.assign(rank=stats["code"].map(rank)).sort_values(["patient", "rank"], kind="stable")
+    lines = [
+        (row[3], _vital_line(*row))
+        for row in zip(stats["code"], stats["value"], stats["number"], stats["date"],
+                       stats["min"], stats["max"], stats["count"], stats["sum"])
     ]
-    recent_obs = recent_obs[recent_obs['DESCRIPTION'].isin(relevant_codes)]
-    
-    if not recent_obs.empty:
-        vitals_summary = ", ".join(
-            f"{row['DESCRIPTION']}: {row['VALUE']}" 
-            for _, row in recent_obs.iterrows()
-        )
-    else:
-        vitals_summary = "No relevant vitals recorded in the past 3 years"
-    
-    patient_conditions = conditions_df[conditions_df["PATIENT"] == patient_id]
-    conditions_summary = ", ".join(patient_conditions["DESCRIPTION"].unique()) \
-        if not patient_conditions.empty else "No conditions recorded"
-    
-    # Formatted summary
-    summary = f"""
-Patient Summary:
-Name: {name}
-Age: {age}, Gender: {gender}, Race: {race}, Ethnicity: {ethnicity}
-
-Vitals (last 3 years): {vitals_summary}
-Conditions: {conditions_summary}
-"""
-    return summary.strip()
+    # (latest date, line) per vital, so the renderer can drop the oldest first
+    vitals = _split_runs(stats["patient"].to_numpy(), lines)
+
+    values = stats.pivot(index="patient", columns="code", values="value")
+    for code in ehr.vital_codes:
+        summaries[code] = values[code] if code in values else np.nan
+
+    # Conditions: active ones only, first occurrence per patient, in record order
+    cond = pd.DataFrame({"patient": store.cond_patients, "description": store.cond_descriptions})
+    cond = cond[store.cond_active]
+    if patient_ids is not None:
+        cond = cond[cond["patient"].isin(wanted)]
+    cond = cond.drop_duplicates(["patient", "description"])
+    cond_patients = cond["patient"].to_numpy()
+    descriptions = cond["description"].to_numpy(dtype=object)
+    starts = _run_starts(cond_patients)
+    conditions = pd.Series([list(c) for c in np.split(descriptions, starts[1:])] if len(starts) else [],
+                           index=cond_patients[starts], dtype=object)
+    summaries["conditions"] = [c if isinstance(c, list) else []
+                               for c in conditions.reindex(summaries.index)]
+
+    headers = ("Patient Summary:\nName: " + summaries["name"]
+               + "\nAge: " + summaries["age"].astype(str) + ", Gender: " + summaries["gender"]
+               + ", Race: " + summaries["race"] + ", Ethnicity: " + summaries["ethnicity"])
+    patient_vitals = [v if isinstance(v, list) else [] for v in vitals.reindex(summaries.index)]
+    summaries["context"] = [
+        _render_context(header, years, lines, patient_conditions, ehr.token_budget)
+        for header, lines, patient_conditions in zip(headers, patient_vitals, summaries["conditions"])
+    ]
+    summaries["tokens"] = summaries["context"].map(estimate_tokens)
+    return summaries
+
+
+class ContextCache:
+    """LRU memo of get_patient_context keyed by patient and source-data version.
+
+    Records change far less often than they are read, so repeat encounters
+    return the rendered summary directly. When any source CSV changes, the
+    loader is reset and every cached summary is dropped.
+    """
+
+    def __init__(self, ehr=None, capacity=512):
+        self.ehr = ehr or loader
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _check_version(self):
+        version = self.ehr.data_version()
+        if version != self._version:
+            if self._version is not None:
+                print("[EHR] Source data changed, reloading")
+                self.ehr.reset()
+            self._entries.clear()
+            self._version = version
+        return version
+
+    def get(self, patient_id):
+        patient_id = str(patient_id)
+        with self._lock:
+            version = self._check_version()
+            if patient_id in self._entries:
+                self._entries.move_to_end(patient_id)
+                self.hits += 1
+                return self._entries[patient_id]
+            self.misses += 1
+
+        context = get_patient_context(patient_id, self.ehr)
+        with self._lock:
+            self._put(version, patient_id, context)
+        return context
+
+    def _put(self, version, patient_id, context):
+        if self._version != version:
+            return
+        self._entries[patient_id] = context
+        self._entries.move_to_end(patient_id)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def precompute(self, patient_ids):
+        """Warm the cache for the next patients of the round in one bulk pass.
+
+        Only the first `capacity` ids are taken, so warming never evicts the
+        patients it was asked for, and ids already cached are not rebuilt.
+        The first id ends up most recently used, the last one is evicted first.
+        """
+        patient_ids = [str(pid) for pid in patient_ids][:self.capacity]
+        with self._lock:
+            version = self._check_version()
+            missing = [pid for pid in patient_ids if pid not in self._entries]
+        contexts = bulk_patient_summaries(self.ehr, missing)["context"] if missing else {}
+        with self._lock:
+            for pid in reversed(patient_ids):
+                if pid in contexts:
+                    self._put(version, pid, contexts[pid])
+                elif pid in self._entries:
+                    self._entries.move_to_end(pid)
+
+    def stats(self):
+        with self._lock:
+            tokens = [estimate_tokens(context) for context in self._entries.values()]
+            return {"size": len(self._entries), "capacity": self.capacity,
+                    "hits": self.hits, "misses": self.misses,
+                    "max_tokens": max(tokens, default=0),
+                    "mean_tokens": round(sum(tokens) / len(tokens), 1) if tokens else 0}
+
+
+# Default context cache used by the robot client
+context_cache = ContextCache()
 
 # Sample patient
 if __name__ == "__main__":
     # Patient ID from dataset
     example_patient_id = '184668ad-08d8-2c05-cb16-c7040f00b848'
-    print(get_patient_context(example_patient_id))
+    context = get_patient_context(example_patient_id)
+    print(context)
+    print(f"[EHR] ~{estimate_tokens(context)} tokens (budget {loader.token_budget})")
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""Threaded camera capture and throttled face detection for the robot.
+
+FrameGrabber reads frames on its own thread and keeps only the newest, so a
+slow consumer never works through a backlog. FaceTracker runs the Haar
+cascade on a downscaled grayscale copy every `detect_every` frames and
+follows the faces it found with template matching in between. FacePipeline
+ties the two together on a detection thread and publishes the latest
+(frame, faces) pair for the UI loop.
+
+Measure a configuration against a recorded video instead of the camera:
+
+    python face_pipeline.py clip.mp4 --scale 0.5 --detect-every 5
+"""
+import argparse, threading, time
+import cv2
+
+HAAR_CASCADE = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+
+
+class FrameGrabber:
+    """Reads `source` (camera index or video path) on a thread, keeping only the latest frame.
+
+    Video files are paced at their native frame rate so they behave like a
+    camera; pass `pace=False` to read them as fast as possible.
+    """
+
+    def __init__(self, source, pace=None):
+        self.is_file = isinstance(source, str)
+        self.cap = cv2.VideoCapture(source)
+        fps = self.cap.get(cv2.CAP_PROP_FPS) if self.is_file else 0
+        pace = self.is_file if pace is None else pace
+        self.interval = 1.0 / fps if pace and fps > 0 else 0
+        self.captured = 0
+        self.ended = False
+        self._frame = None
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        next_at = time.monotonic()
+        while not self._stop.is_set():
+            ok, frame = self.cap.read()
+            if not ok:
+                if self.is_file:
+                    break
+                time.sleep(0.01)
+                continue
+            with self._cond:
+                self._frame = frame
+                self._seq += 1
+                self.captured += 1
+                self._cond.notify_all()
+            if self.interval:
+                next_at += self.interval
+                time.sleep(max(0.0, next_at - time.monotonic()))
+        self.cap.release()
+        with self._cond:
+            self.ended = True
+            self._cond.notify_all()
+
+    def read(self, after=0, timeout=1.0):
+        """Return (seq, frame) for the newest frame after `after`, or (after, None) on timeout/end."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > after or self.ended, timeout)
+            if self._seq > after:
+                return self._seq, self._frame
+            return after, None
+
+    def stop(self):
+        self._stop.set()
+
+
+class FaceTracker:
+    """Detect faces on a downscaled image every Nth frame and track them in between.
+
+    Boxes are returned in full-resolution coordinates. `cpu_seconds` is the
+    CPU time spent in update(), split by `detections` and `tracked` frames.
+    """
+
+    def __init__(self, cascade_path=HAAR_CASCADE, scale=0.5, detect_every=5, min_size=60,
+                 scale_factor=1.2, min_neighbors=5, track_margin=0.5, track_threshold=0.6):
+        self.cascade = cv2.CascadeClassifier(cascade_path)
+        self.scale = scale
+        self.detect_every = max(1, detect_every)
+        self.min_size = max(1, int(min_size * scale))
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.track_margin = track_margin
+        self.track_threshold = track_threshold
+        self._templates = []   # [(box in small coords, gray patch)]
+        self.frames = 0
+        self.detections = 0
+        self.tracked = 0
+        self.cpu_seconds = 0.0
+
+    def update(self, frame):
+        start = time.thread_time()
+        small = frame if self.scale == 1 else cv2.resize(
+            frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        if self.frames % self.detect_every == 0:
+            boxes = self.cascade.detectMultiScale(gray, self.scale_factor, self.min_neighbors,
+                                                  minSize=(self.min_size, self.min_size))
+            self._templates = [((x, y, w, h), gray[y:y + h, x:x + w].copy()) for x, y, w, h in boxes]
+            self.detections += 1
+        elif self._templates:
+            self._track(gray)
+            self.tracked += 1
+        self.frames += 1
+        self.cpu_seconds += time.thread_time() - start
+        return [tuple(int(v / self.scale) for v in box) for box, _ in self._templates]
+
+    def _track(self, gray):
+        """Follow each face by template matching inside a window around its last box."""
+        height, width = gray.shape
+        kept = []
+        for (x, y, w, h), patch in self._templates:
+            mx, my = int(w * self.track_margin), int(h * self.track_margin)
+            x0, y0 = max(0, x - mx), max(0, y - my)
+            window = gray[y0:min(height, y + h + my), x0:min(width, x + w + mx)]
+            if window.shape[0] < h or window.shape[1] < w:
+                continue
+            scores = cv2.matchTemplate(window, patch, cv2.TM_CCOEFF_NORMED)
+            _, best, _, (bx, by) = cv2.minMaxLoc(scores)
+            if best >= self.track_threshold:
+                kept.append(((x0 + bx, y0 + by, w, h), window[by:by + h, bx:bx + w].copy()))
+        self._templates = kept
+
+
+class FacePipeline:
+    """Capture thread plus detection thread; the UI only reads `latest()`."""
+
+    def __init__(self, source, pace=None, **tracker_options):
+        self.grabber = FrameGrabber(source, pace)
+        self.tracker = FaceTracker(**tracker_options)
+        self.processed = 0
+        self.started = time.monotonic()
+        self._latest = (0, None, [])
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        seq = 0
+        while True:
+            seq, frame = self.grabber.read(after=seq)
+            if frame is None:
+                if self.grabber.ended:
+                    break
+                continue
+            faces = self.tracker.update(frame)
+            with self._cond:
+                self.processed += 1
+                self._latest = (seq, frame, faces)
+                self._cond.notify_all()
+        with self._cond:
+            self._cond.notify_all()
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    def latest(self, after=0, timeout=0.1):
+        """Return (seq, frame, faces) newer than `after`; frame is None if nothing new arrived."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._latest[0] > after or not self.running, timeout)
+            if self._latest[0] > after:
+                return self._latest
+            return after, None, []
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        tracker = self.tracker
+        return {
+            "capture_fps": round(self.grabber.captured / elapsed, 1),
+            "processed_fps": round(self.processed / elapsed, 1),
+            "dropped": self.grabber.captured - self.processed,
+            "detections": tracker.detections,
+            "tracked": tracker.tracked,
+            "detect_cpu_pct": round(100 * tracker.cpu_seconds / elapsed, 1),
+        }
+
+    def stop(self):
+        self.grabber.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the face pipeline on a video file or camera.")
+    parser.add_argument("source", help="video file, or a camera index")
+    parser.add_argument("--scale", type=float, default=0.5)
+    parser.add_argument("--detect-every", type=int, default=5)
+    parser.add_argument("--min-size", type=int, default=60)
+    parser.add_argument("--seconds", type=float, default=None, help="stop after this long")
+    parser.add_argument("--no-pace", action="store_true", help="read files as fast as possible")
+    parser.add_argument("--show", action="store_true")
+    args = parser.parse_args()
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    pipeline = FacePipeline(source, pace=False if args.no_pace else None, scale=args.scale,
+                            detect_every=args.detect_every, min_size=args.min_size)
+    seq = 0
+    while pipeline.running:
+        if args.seconds and time.monotonic() - pipeline.started >= args.seconds:
+            break
+        seq, frame, faces = pipeline.latest(after=seq)
+        if args.show and frame is not None:
+            frame = frame.copy()
+            for (x, y, w, h) in faces:
+                cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+            cv2.imshow("Face pipeline", frame)
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                break
+    pipeline.stop()
+    print("[FACE]", pipeline.stats())
+
+
+if __name__ == "__main__":
+    main()
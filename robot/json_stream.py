@@ -0,0 +1,101 @@
+"""Incremental JSON helpers for streamed model output."""
+import json
+
+ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+
+
+def parse_object(text):
+    """Decode the first JSON object in `text`, or None if there is none."""
+    start = text.find("{")
+    if start < 0:
+        return None
+    try:
+        obj, _ = json.JSONDecoder().raw_decode(text, start)
+    except ValueError:
+        return None
+    return obj if isinstance(obj, dict) else None
+
+
+class JSONFieldStream:
+    """Scan a JSON object as it streams in and surface one top-level string field early.
+
+    `feed(chunk)` returns the decoded characters of `field` that arrived in
+    that chunk, so a question can be spoken before the object is complete.
+    `result()` decodes everything fed so far once the stream has ended.
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self.raw = []
+        self._stack = []          # open containers, "{" or "["
+        self._expect_key = False
+        self._last_key = None
+        self._in_string = False
+        self._is_key = False
+        self._capturing = False
+        self._chars = []
+        self._escape = None       # None, "" right after a backslash, or "u" + hex digits
+
+    def feed(self, chunk):
+        self.raw.append(chunk)
+        out = []
+        for c in chunk:
+            if self._in_string:
+                self._string_char(c, out)
+            elif c in "{[":
+                self._stack.append(c)
+                self._expect_key = c == "{"
+            elif c in "}]":
+                if self._stack:
+                    self._stack.pop()
+            elif c == ",":
+                self._expect_key = bool(self._stack) and self._stack[-1] == "{"
+            elif c == ":":
+                self._expect_key = False
+            elif c == '"':
+                self._in_string = True
+                self._is_key = self._expect_key
+                self._chars = []
+                self._capturing = (not self._is_key and len(self._stack) == 1
+                                   and self._last_key == self.field)
+        return "".join(out)
+
+    def _string_char(self, c, out):
+        decoded = None
+        if self._escape is not None:
+            if self._escape == "" and c == "u":
+                self._escape = "u"
+                return
+            if self._escape.startswith("u"):
+                if c not in HEX_DIGITS:
+                    # malformed \u escape: drop it and read `c` as an ordinary character
+                    self._escape = None
+                    return self._string_char(c, out)
+                self._escape += c
+                if len(self._escape) < 5:
+                    return
+                decoded = chr(int(self._escape[1:], 16))
+            else:
+                decoded = ESCAPES.get(c, c)
+            self._escape = None
+        elif c == "\\":
+            self._escape = ""
+            return
+        elif c == '"':
+            self._in_string = False
+            self._capturing = False
+            if self._is_key:
+                self._last_key = "".join(self._chars)
+            return
+        else:
+            decoded = c
+        self._chars.append(decoded)
+        if self._capturing:
+            out.append(decoded)
+
+    def text(self):
+        return "".join(self.raw)
+
+    def result(self):
+        return parse_object(self.text())
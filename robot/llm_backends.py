@@ -0,0 +1,220 @@
+"""LLM backends for the triage server.
+
+Every backend exposes `generate(prompt) -> str`, `stream(prompt)` (yields
+text fragments as they are produced), the chat equivalents `chat(messages)`
+and `stream_chat(messages)`, and `warm()`. The HTTP backend talks to the
+Ollama REST API over a pooled keep-alive session and asks Ollama to keep
+the model resident, so a turn only pays for inference. Its chat calls let
+Ollama reuse the KV cache of an unchanged message prefix, so each triage
+turn only evaluates the newest message, and accept a JSON schema that
+constrains decoding. Backends without structured output ignore the schema.
+"""
+import json, os, subprocess
+import requests
+from requests.adapters import HTTPAdapter
+
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://127.0.0.1:11434")
+OLLAMA_MODEL = "llama3.2"
+# "http" (Ollama REST, keep-alive), "cli" (ollama run) or "fake" (offline)
+LLM_BACKEND = os.environ.get("TRIAGE_LLM_BACKEND", "http")
+# max LLM generations running at once; extra turns wait in the inference queue
+LLM_CONCURRENCY = int(os.environ.get("TRIAGE_LLM_CONCURRENCY", "2"))
+# how long Ollama keeps the model loaded after the last request
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+
+
+def flatten_messages(messages):
+    """Render chat messages as one prompt for backends without a chat API."""
+    return "\n\n".join(f"{m['role'].capitalize()}: {m['content'].strip()}" for m in messages) \
+        + "\n\nAssistant:"
+
+
+def log_eval_stats(data):
+    """Print Ollama's prompt/generation timings so prefix reuse is visible per turn."""
+    if "prompt_eval_count" in data or "eval_count" in data:
+        print(f"[LLM] prompt eval {data.get('prompt_eval_count', 0)} tok "
+              f"{data.get('prompt_eval_duration', 0) / 1e9:.2f}s, "
+              f"generated {data.get('eval_count', 0)} tok "
+              f"{data.get('eval_duration', 0) / 1e9:.2f}s")
+
+
+class OllamaHTTPBackend:
+    """Ollama REST client reusing pooled HTTP connections across turns."""
+
+    def __init__(self, model, base_url=OLLAMA_URL, keep_alive=OLLAMA_KEEP_ALIVE,
+                 timeout=60, pool_size=8):
+        self.model = model
+        self.base_url = base_url.rstrip("/")
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _post(self, path, payload):
+        resp = self.session.post(f"{self.base_url}{path}", json=payload, timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    def generate(self, prompt):
+        data = self._post("/api/generate", {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": False,
+            "keep_alive": self.keep_alive,
+        })
+        return data.get("response", "").strip()
+
+    def stream(self, prompt):
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": True,
+            "keep_alive": self.keep_alive,
+        }
+        with self.session.post(f"{self.base_url}/api/generate", json=payload,
+                               timeout=self.timeout, stream=True) as resp:
+            resp.raise_for_status()
+            # Ollama streams one JSON object per line
+            for line in resp.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("response"):
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    log_eval_stats(chunk)
+                    break
+
+    def _chat_payload(self, messages, schema, stream):
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+        }
+        if schema is not None:
+            payload["format"] = schema
+        return payload
+
+    def chat(self, messages, schema=None):
+        data = self._post("/api/chat", self._chat_payload(messages, schema, False))
+        log_eval_stats(data)
+        return data.get("message", {}).get("content", "").strip()
+
+    def stream_chat(self, messages, schema=None):
+        payload = self._chat_payload(messages, schema, True)
+        with self.session.post(f"{self.base_url}/api/chat", json=payload,
+                               timeout=self.timeout, stream=True) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                content = chunk.get("message", {}).get("content")
+                if content:
+                    yield content
+                if chunk.get("done"):
+                    log_eval_stats(chunk)
+                    break
+
+    def warm(self):
+        """Load the model into memory without generating anything."""
+        self._post("/api/generate", {"model": self.model, "keep_alive": self.keep_alive})
+
+
+class OllamaCLIBackend:
+    """The original `ollama run` subprocess path, one process per call."""
+
+    def __init__(self, model, timeout=60):
+        self.model = model
+        self.timeout = timeout
+
+    def generate(self, prompt):
+        result = subprocess.run(
+            ["ollama", "run", self.model],
+            input=prompt.encode("utf-8"),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=self.timeout
+        )
+        return result.stdout.decode("utf-8").strip()
+
+    def stream(self, prompt):
+        proc = subprocess.Popen(
+            ["ollama", "run", self.model],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        try:
+            proc.stdin.write(prompt.encode("utf-8"))
+            proc.stdin.close()
+            while True:
+                data = proc.stdout.read1(256)
+                if not data:
+                    break
+                yield data.decode("utf-8", errors="ignore")
+        finally:
+            proc.kill()
+            proc.wait()
+
+    def chat(self, messages, schema=None):
+        return self.generate(flatten_messages(messages))
+
+    def stream_chat(self, messages, schema=None):
+        return self.stream(flatten_messages(messages))
+
+    def warm(self):
+        pass
+
+
+class FakeBackend:
+    """Offline stand-in that replays scripted replies and records prompts.
+
+    `replies` is a list consumed in order (the last one repeats) or a
+    callable taking the prompt.
+    """
+
+    def __init__(self, replies=None):
+        self.replies = replies if replies is not None else [
+            '{"action": "verdict", "emergency_index": 10, "priority_label": "low", "rationale": "fake backend"}'
+        ]
+        self.prompts = []
+
+    def generate(self, prompt):
+        self.prompts.append(prompt)
+        if callable(self.replies):
+            return self.replies(prompt)
+        index = min(len(self.prompts), len(self.replies)) - 1
+        return self.replies[index]
+
+    def stream(self, prompt):
+        for word in self.generate(prompt).split(" "):
+            yield word + " "
+
+    def chat(self, messages, schema=None):
+        return self.generate(flatten_messages(messages))
+
+    def stream_chat(self, messages, schema=None):
+        return self.stream(flatten_messages(messages))
+
+    def warm(self):
+        pass
+
+
+BACKENDS = {
+    "http": OllamaHTTPBackend,
+    "cli": OllamaCLIBackend,
+    "fake": lambda model: FakeBackend(),
+}
+
+
+def make_backend(name, model):
+    """Build a backend by name: "http" (default), "cli" or "fake"."""
+    try:
+        factory = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown LLM backend {name!r}; choose from {sorted(BACKENDS)}") from None
+    return factory(model)
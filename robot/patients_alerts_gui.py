@@ -2,8 +2,53 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 import requests
 import datetime
+import queue
+import threading
+import time
 
 BASE_URL = "http://127.0.0.1:8001"  # Flask server address
+REQUEST_TIMEOUT = (3, 10)            # connect / read seconds
+AUTO_REFRESH_MS = 5000
+MAX_BACKOFF_MS = 60000
+HIGH_PRIORITIES = ("high", "critical")
+
+
+class NetworkWorker:
+    """Runs blocking HTTP calls off the Tk thread and hands results back to it.
+
+    Jobs get a persistent requests.Session; their (result, error) is queued
+    and delivered to the callback from the Tk mainloop, so widgets are only
+    ever touched on the Tk thread.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.session = requests.Session()
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+        self._deliver()
+
+    def submit(self, func, callback):
+        self.jobs.put((func, callback))
+
+    def _run(self):
+        while True:
+            func, callback = self.jobs.get()
+            try:
+                result, error = func(self.session), None
+            except Exception as e:
+                result, error = None, e
+            self.results.put((callback, result, error))
+
+    def _deliver(self):
+        while True:
+            try:
+                callback, result, error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            callback(result, error)
+        self.root.after(50, self._deliver)
 
 class PatientAlertsGUI:
     def __init__(self, root):
@@ -11,6 +56,23 @@ class PatientAlertsGUI:
         self.root.title("Nursing Home Alerts and Severity Tracking")
         self.root.configure(bg="#f5f7fa")  # subtle gray background
         self.queue = []
+        # local copy of the server queue, kept current from the change feed
+        self.alerts = {}
+        self.feed_epoch = None
+        self.feed_seq = -1
+        self.etag = None
+        # patient_id and display text of every listbox row, in row order
+        self.row_ids = {"high_listbox": [], "general_listbox": []}
+        self.row_texts = {"high_listbox": [], "general_listbox": []}
+
+        # background networking and auto-refresh state
+        self.net = NetworkWorker(root)
+        self.refreshing = False
+        self.refresh_job = None
+        self.next_refresh = None
+        self.last_success = None
+        self.last_error = None
+        self.failures = 0
 
         # --------------------
         # Title banner
@@ -98,7 +160,8 @@ class PatientAlertsGUI:
         )
         self.status_label.pack(fill="x", side="bottom")
 
-        self.refresh_queue()
+        self.refresh_queue(manual=False)
+        self.tick_status()
 
     def build_alert_section(self, parent, title, bg, list_attr):
         """Helper to build a styled alert section with scrollable listbox."""
@@ -126,27 +189,140 @@ class PatientAlertsGUI:
 
         setattr(self, list_attr, listbox)
 
-    def refresh_queue(self):
-        """Fetch and display alert queue from server"""
-        try:
-            response = requests.get(f"{BASE_URL}/alerts")
+    def refresh_queue(self, manual=True):
+        """Fetch changes since the last refresh in the background"""
+        if self.refreshing:
+            return
+        self.refreshing = True
+        headers = {"If-None-Match": self.etag} if self.etag else {}
+        params = {"since": self.feed_seq, "epoch": self.feed_epoch}
+
+        def fetch(session):
+            response = session.get(f"{BASE_URL}/alerts/changes", params=params,
+                                   headers=headers, timeout=REQUEST_TIMEOUT)
+            if response.status_code == 304:
+                return None, self.etag
             response.raise_for_status()
-            self.queue = response.json()
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to fetch queue:\n{e}")
+            return response.json(), response.headers.get("ETag")
+
+        self.net.submit(fetch, lambda result, error: self.on_refreshed(result, error, manual))
+
+    def on_refreshed(self, result, error, manual):
+        """Apply a finished fetch on the Tk thread and schedule the next one"""
+        self.refreshing = False
+        if error is not None:
+            self.failures += 1
+            self.last_error = str(error)
+            if manual:
+                messagebox.showerror("Error", f"Failed to fetch queue:\n{error}")
+            # back off while the server is slow or down
+            self.schedule_refresh(min(AUTO_REFRESH_MS * 2 ** self.failures, MAX_BACKOFF_MS))
+            self.update_status()
             return
 
-        self.high_listbox.delete(0, tk.END)
-        self.general_listbox.delete(0, tk.END)
+        self.failures = 0
+        self.last_error = None
+        self.last_success = time.time()
+        update, etag = result
+        if update is not None:
+            self.apply_changes(update)
+            self.etag = etag
+            self.render_queue()
+        self.schedule_refresh(AUTO_REFRESH_MS)
+        self.update_status()
 
+    def schedule_refresh(self, delay_ms):
+        if self.refresh_job is not None:
+            self.root.after_cancel(self.refresh_job)
+        self.next_refresh = time.time() + delay_ms / 1000
+        self.refresh_job = self.root.after(delay_ms, lambda: self.refresh_queue(manual=False))
+
+    def update_status(self):
+        """Show how fresh the displayed queue is"""
+        if self.last_success is None:
+            text = "Connecting to alert server..."
+        else:
+            updated = datetime.datetime.fromtimestamp(self.last_success).strftime('%H:%M:%S')
+            age = int(time.time() - self.last_success)
+            text = f"Last updated at {updated} ({age}s ago)"
+        if self.last_error is not None:
+            retry = max(0, int(self.next_refresh - time.time())) if self.next_refresh else 0
+            text += f" | Server unreachable, retrying in {retry}s: {self.last_error}"
+        self.status_label.config(text=text, fg="#b00020" if self.last_error else "#333")
+
+    def tick_status(self):
+        self.update_status()
+        self.root.after(1000, self.tick_status)
+
+    def apply_changes(self, update):
+        """Apply a change-feed response (snapshot or deltas) to the local queue"""
+        if update.get("reset"):
+            self.alerts = {a["patient_id"]: a for a in update["alerts"]}
+        else:
+            for change in update.get("changes", []):
+                if change["op"] == "upsert":
+                    self.alerts[change["patient_id"]] = change["entry"]
+                elif change["op"] == "remove":
+                    self.alerts.pop(change["patient_id"], None)
+                elif change["op"] == "clear":
+                    self.alerts.clear()
+        self.feed_epoch = update["epoch"]
+        self.feed_seq = update["seq"]
+        # same order as the server: highest score first, older alerts first on ties
+        self.queue = sorted(self.alerts.values(),
+                            key=lambda a: (-int(a.get("score", 0)), a.get("timestamp", "")))
+
+    @staticmethod
+    def format_alert(alert):
+        return f"{alert['patient_id']} - {alert['name']} | Score: {alert.get('score','?')} | Priority: {alert['priority']}"
+
+    def render_queue(self):
+        """Bring both alert lists in line with self.queue, touching only changed rows"""
+        high, general = [], []
         for alert in self.queue:
-            display_text = f"{alert['patient_id']} - {alert['name']} | Score: {alert.get('score','?')} | Priority: {alert['priority']}"
-            if str(alert.get("priority", "")).lower() in ["high", "critical"]:
-                self.high_listbox.insert(tk.END, display_text)
+            if str(alert.get("priority", "")).lower() in HIGH_PRIORITIES:
+                high.append(alert["patient_id"])
             else:
-                self.general_listbox.insert(tk.END, display_text)
+                general.append(alert["patient_id"])
+        self.sync_listbox("high_listbox", high)
+        self.sync_listbox("general_listbox", general)
 
-        self.status_label.config(text=f"Last refreshed at {datetime.datetime.now().strftime('%H:%M:%S')}")
+    def sync_listbox(self, list_attr, wanted_ids):
+        """Diff a listbox against the wanted patient order; selection and scroll survive"""
+        listbox = getattr(self, list_attr)
+        rows = self.row_ids[list_attr]
+        texts = self.row_texts[list_attr]
+
+        wanted = set(wanted_ids)
+        for idx in range(len(rows) - 1, -1, -1):
+            if rows[idx] not in wanted:
+                listbox.delete(idx)
+                del rows[idx], texts[idx]
+
+        for i, pid in enumerate(wanted_ids):
+            text = self.format_alert(self.alerts[pid])
+            if i < len(rows) and rows[i] == pid:
+                if texts[i] != text:
+                    self.replace_row(listbox, i, i, text)
+                    texts[i] = text
+                continue
+            # row moved up from further down, or is new
+            if pid in rows:
+                j = rows.index(pid, i)
+                self.replace_row(listbox, j, i, text)
+                del rows[j], texts[j]
+            else:
+                listbox.insert(i, text)
+            rows.insert(i, pid)
+            texts.insert(i, text)
+
+    @staticmethod
+    def replace_row(listbox, old_idx, new_idx, text):
+        selected = listbox.selection_includes(old_idx)
+        listbox.delete(old_idx)
+        listbox.insert(new_idx, text)
+        if selected:
+            listbox.selection_set(new_idx)
 
     def view_alert(self):
         """Show full alert details for selected patient"""
@@ -154,10 +330,10 @@ class PatientAlertsGUI:
 
         if self.high_listbox.curselection():
             idx = self.high_listbox.curselection()[0]
-            alert = [a for a in self.queue if str(a.get("priority", "")).lower() in ["high", "critical"]][idx]
+            alert = self.alerts[self.row_ids["high_listbox"][idx]]
         elif self.general_listbox.curselection():
             idx = self.general_listbox.curselection()[0]
-            alert = [a for a in self.queue if str(a.get("priority", "")).lower() not in ["high", "critical"]][idx]
+            alert = self.alerts[self.row_ids["general_listbox"][idx]]
         else:
             messagebox.showwarning("No Selection", "Please select an alert first.")
             return
@@ -173,14 +349,19 @@ class PatientAlertsGUI:
         if not messagebox.askyesno("Confirm", "Are you sure you want to clear the entire queue?"):
             return
 
-        try:
-            response = requests.post(f"{BASE_URL}/clear")
+        def post(session):
+            response = session.post(f"{BASE_URL}/clear", timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
-            msg = response.json().get("msg", "Queue cleared")
+            return response.json().get("msg", "Queue cleared")
+
+        def done(msg, error):
+            if error is not None:
+                messagebox.showerror("Error", f"Failed to clear queue:\n{error}")
+                return
             messagebox.showinfo("Success", msg)
-            self.refresh_queue()
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to clear queue:\n{e}")
+            self.refresh_queue(manual=False)
+
+        self.net.submit(post, done)
 
 
 if __name__ == "__main__":
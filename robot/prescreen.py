@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Overnight pre-screening: EHR-only triage verdicts for many residents.
+
+The triage servers expose this as POST /triage/batch with
+{"patient_ids": [...]}. Contexts are built in one pass, verdicts are
+generated with bounded parallelism and streamed back as NDJSON lines as
+they complete, and the resulting alerts are pushed to server.py with a
+single POST /alerts/bulk at the end. Unknown IDs get an error line and no
+model call, and fallback verdicts (the model gave nothing usable) are
+reported but never queued as alerts. Pushed alerts are marked
+`"source": "prescreen"`, so they never replace a higher-scoring alert from
+a live encounter.
+
+Run a round against a running triage server with:
+
+    python prescreen.py              # every patient in patients.csv
+    python prescreen.py ID [ID ...]
+"""
+import argparse, json, os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+import ehr_parser
+
+TRIAGE_BATCH_URL = "http://127.0.0.1:8000/triage/batch"
+ALERT_BULK_URL = os.environ.get("TRIAGE_ALERT_BULK_URL", "http://127.0.0.1:8001/alerts/bulk")
+
+
+def build_contexts(patient_ids, ehr=None):
+    """Map patient_id -> (name, context summary); IDs missing from the EHR are left out."""
+    summaries = ehr_parser.bulk_patient_summaries(ehr, patient_ids)
+    contexts = {}
+    for pid in patient_ids:
+        if str(pid) in summaries.index:
+            row = summaries.loc[str(pid)]
+            contexts[pid] = (row["name"], row["context"])
+    return contexts
+
+
+def to_alert(patient_id, name, verdict):
+    score = int(verdict.get("emergency_index", 0))
+    # the engine has already applied the vitals rules and critical_score
+    priority = verdict.get("priority_label", "low")
+    return {
+        "patient_id": patient_id,
+        "name": name,
+        "score": score,
+        "priority": priority,
+        "rationale": verdict.get("rationale", ""),
+        "source": "prescreen",
+    }
+
+
+def push_alerts(alerts, url=ALERT_BULK_URL):
+    resp = requests.post(url, json=alerts, timeout=30)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def run_batch(engine, patient_ids, workers, push=True):
+    """Yield one NDJSON line per patient as verdicts complete, then a summary line."""
+    contexts = build_contexts(patient_ids)
+    unknown = [pid for pid in patient_ids if pid not in contexts]
+    for pid in unknown:
+        yield json.dumps({"patient_id": pid, "error": f"No patient found with ID {pid}"}) + "\n"
+
+    alerts = []
+    fallbacks = 0
+    # the engine's inference queue still caps concurrent generations
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(engine.prescreen, pid, context): pid
+                   for pid, (_, context) in contexts.items()}
+        for future in as_completed(futures):
+            pid = futures[future]
+            verdict = future.result()
+            if verdict.get("fallback"):
+                # not a real assessment, so it must not look like one in the alert queue
+                fallbacks += 1
+                alert = None
+            else:
+                alert = to_alert(pid, contexts[pid][0], verdict)
+                alerts.append(alert)
+            yield json.dumps({"patient_id": pid, "verdict": verdict, "alert": alert}) + "\n"
+
+    summary = {"done": True, "count": len(alerts), "unknown": len(unknown), "fallback": fallbacks}
+    if push and alerts:
+        try:
+            summary["pushed"] = push_alerts(alerts).get("count", 0)
+        except Exception as e:
+            summary["push_error"] = str(e)
+    yield json.dumps(summary) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-screen residents from their EHR alone.")
+    parser.add_argument("patient_ids", nargs="*", help="defaults to every patient in patients.csv")
+    parser.add_argument("--server", default=TRIAGE_BATCH_URL)
+    parser.add_argument("--no-push", action="store_true", help="do not queue alerts")
+    args = parser.parse_args()
+
+    ids = args.patient_ids or [str(pid) for pid in ehr_parser.loader.patients["Id"]]
+    payload = {"patient_ids": ids, "push_alerts": not args.no_push}
+    with requests.post(args.server, json=payload, stream=True, timeout=None) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            result = json.loads(line)
+            if result.get("done"):
+                print("[PRESCREEN] Done:", result)
+            elif "error" in result:
+                print(f"[PRESCREEN] {result['patient_id']}: {result['error']}")
+            elif result["alert"] is None:
+                print(f"[PRESCREEN] {result['patient_id']}: no usable verdict, not queued")
+            else:
+                alert = result["alert"]
+                print(f"[PRESCREEN] {alert['name']}: {alert['score']} ({alert['priority']})")
+
+
+if __name__ == "__main__":
+    main()
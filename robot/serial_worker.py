@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""Background serial worker that owns the ESP32 port.
+
+Callers enqueue commands with `send("HIGH")`, which returns a Future at
+once. The worker thread writes each command, waits up to `ack_timeout` for
+a reply line that acknowledges it (by default any line mentioning the
+command) and resolves the Future with that line, or None on timeout. If
+the port disappears it is closed and reopened, re-detecting it through
+`find_port` so a re-enumerated USB device is picked up again.
+
+Any pyserial URL works as the port, e.g. "loop://" echoes every command
+back. FakeESP32 provides a pty that answers like the board, for testing
+without hardware:
+
+    python serial_worker.py          # round-trips a few commands through FakeESP32
+"""
+import os, queue, threading, time
+from concurrent.futures import Future
+import serial
+
+ACK_TIMEOUT = 1.5
+RECONNECT_INTERVAL = 2.0
+# the ESP32 resets when the port opens; give it time to boot
+SETTLE_SECONDS = 2.0
+
+
+def default_ack(command, line):
+    return command.lower() in line.lower()
+
+
+class SerialWorker:
+    def __init__(self, port=None, baud=115200, find_port=None, ack_timeout=ACK_TIMEOUT,
+                 ack_match=default_ack, reconnect_interval=RECONNECT_INTERVAL,
+                 settle=SETTLE_SECONDS, initial=()):
+        self.port = port
+        self.baud = baud
+        self.find_port = find_port
+        self.ack_timeout = ack_timeout
+        self.ack_match = ack_match
+        self.reconnect_interval = reconnect_interval
+        self.settle = settle
+        self.initial = list(initial)    # commands replayed after every (re)connect
+        self.metrics = {"sent": 0, "acked": 0, "timeouts": 0, "dropped": 0, "connects": 0}
+        self._ser = None
+        self._next_attempt = 0.0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def send(self, command):
+        """Queue `command`; the Future resolves to the ack line, or None if unacknowledged."""
+        future = Future()
+        self._queue.put((command, future))
+        return future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=self.ack_timeout + 1)
+
+    @property
+    def connected(self):
+        return self._ser is not None
+
+    def _connect(self):
+        if self._ser is not None:
+            return True
+        now = time.monotonic()
+        if now < self._next_attempt:
+            return False
+        self._next_attempt = now + self.reconnect_interval
+        port = self.port or (self.find_port() if self.find_port else None)
+        if not port:
+            return False
+        try:
+            # a write that cannot complete (wedged port) fails instead of stalling the worker
+            self._ser = serial.serial_for_url(port, self.baud, timeout=0.1,
+                                              write_timeout=self.ack_timeout)
+        except (serial.SerialException, OSError) as e:
+            print(f"[ESP32] Could not open {port}: {e}")
+            return False
+        print("[ESP32] Connected on", port)
+        self.metrics["connects"] += 1
+        time.sleep(self.settle)
+        for command in self.initial:
+            self._transact(command)
+        return self._ser is not None
+
+    def _disconnect(self, error):
+        print("[ESP32] Port lost:", error)
+        try:
+            self._ser.close()
+        except Exception:
+            pass
+        self._ser = None
+        self._next_attempt = 0.0   # retry right away on the next command
+
+    def _transact(self, command):
+        """Write one command and wait for its ack; returns the ack line or None."""
+        try:
+            self._ser.reset_input_buffer()
+            self._ser.write((command + "\n").encode())
+            self.metrics["sent"] += 1
+            deadline = time.monotonic() + self.ack_timeout
+            while time.monotonic() < deadline:
+                line = self._ser.readline().decode(errors="replace").strip()
+                if line and self.ack_match(command, line):
+                    self.metrics["acked"] += 1
+                    print(f"[ESP32] Sent: {command} ({line})")
+                    return line
+        except (serial.SerialException, OSError) as e:
+            self._disconnect(e)
+            return None
+        self.metrics["timeouts"] += 1
+        print(f"[ESP32] No ack for {command} within {self.ack_timeout}s")
+        return None
+
+    def _run(self):
+        self._connect()   # open and initialize the board up front, off the caller's thread
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            command, future = item
+            line = None
+            # one retry after a reconnect if the port dropped mid-command
+            for _ in range(2):
+                if not self._connect():
+                    break
+                line = self._transact(command)
+                if self._ser is not None:
+                    break
+            if self._ser is None and line is None:
+                self.metrics["dropped"] += 1
+                print(f"[ESP32] Not connected, dropped {command}")
+            future.set_result(line)
+        if self._ser is not None:
+            self._ser.close()
+            self._ser = None
+
+
+class FakeESP32:
+    """A pty that behaves like the board: answers each command line after `delay` seconds.
+
+    Commands listed in `silent` are never acknowledged, to exercise timeouts.
+    """
+
+    def __init__(self, delay=0.05, silent=()):
+        import pty, tty
+        self.delay = delay
+        self.silent = set(silent)
+        self.received = []
+        self._master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self._slave = slave
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        buffer = b""
+        while True:
+            try:
+                data = os.read(self._master, 1024)
+            except OSError:
+                return
+            buffer += data
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                command = line.decode().strip()
+                self.received.append(command)
+                if command in self.silent:
+                    continue
+                time.sleep(self.delay)
+                os.write(self._master, f"GPIO {command}\n".encode())
+
+    def close(self):
+        os.close(self._master)
+        os.close(self._slave)
+
+
+def main():
+    board = FakeESP32(silent={"BLINK"})
+    worker = SerialWorker(board.port, ack_timeout=0.5, settle=0, initial=["LOW"])
+    start = time.monotonic()
+    futures = [worker.send(cmd) for cmd in ("HIGH", "BLINK", "LOW")]
+    print(f"[ESP32] Enqueued 3 commands in {time.monotonic() - start:.4f}s")
+    for future in futures:
+        print("[ESP32] Result:", future.result())
+    worker.close()
+    board.close()
+    print("[ESP32] Board saw:", board.received, worker.metrics)
+
+
+if __name__ == "__main__":
+    main()
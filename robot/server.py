@@ -1,67 +1,239 @@
 #!/usr/bin/env python3
-from flask import Flask, request, jsonify
-import time, json, os, heapq
+from flask import Flask, Response, request, jsonify, stream_with_context
+import time, json, threading
+from alert_feed import ChangeFeed
+from alert_journal import AlertJournal
+from alert_queue import AlertQueue
 
 app = Flask(__name__)
 ALERT_FILE = "critical_alerts.json"
 
-# alerts is now a heap of tuples (-score, entry)
-alerts = []
+# one live alert per patient, highest score first
+alerts = AlertQueue()
+alerts_lock = threading.Lock()
+# changes are appended to critical_alerts.json.log and folded into the snapshot periodically
+journal = AlertJournal(ALERT_FILE, compact_every=500)
+# sequence-numbered changes for /alerts/changes and /alerts/stream
+feed = ChangeFeed()
 
 # ---- Helpers ----
 def save_alerts():
-    """Save alerts as a sorted list for readability."""
-    with open(ALERT_FILE, "w") as f:
-        sorted_view = [entry for (_, entry) in sorted(alerts)]
-        json.dump(sorted_view, f, indent=2)
+    """Compact the journal into a sorted snapshot for readability."""
+    journal.compact(alerts.sorted_view())
 
 def load_alerts():
-    """Load alerts from file and rebuild heap."""
-    global alerts
-    if os.path.exists(ALERT_FILE):
-        with open(ALERT_FILE, "r") as f:
-            stored = json.load(f)
-            alerts.clear()
-            for entry in stored:
-                # push with -score for max-heap behavior
-                heapq.heappush(alerts, (-int(entry.get("score", 0)), entry))
+    """Load the snapshot, replay the journal on top and rebuild the queue."""
+    stored, records = journal.replay()
+    with alerts_lock:
+        alerts.clear()
+        for entry in stored:
+            # older snapshots may hold several alerts per patient; keep the newest
+            current = alerts.get(entry.get("patient_id"))
+            if current is None or entry.get("timestamp", "") >= current.get("timestamp", ""):
+                alerts.upsert(entry)
+        for record in records:
+            if record["op"] == "add":
+                alerts.upsert(record["entry"])
+            elif record["op"] == "remove":
+                alerts.remove(record["patient_id"])
+            elif record["op"] == "clear":
+                alerts.clear()
+        if records or len(stored) != len(alerts):
+            save_alerts()
+
+def remove_alert(patient_id):
+    with alerts_lock:
+        entry = alerts.remove(patient_id)
+        if entry is not None:
+            journal.append("remove", patient_id=patient_id)
+            feed.publish("remove", patient_id=patient_id)
+            if journal.needs_compaction():
+                save_alerts()
+    return entry
 
 # ---- Routes ----
-@app.route("/alert", methods=["POST"])
-def receive_alert():
-    """Receive critical patient alert from Edison."""
-    data = request.get_json(force=True)
-    if not data:
-        return jsonify({"status": "error", "msg": "No data received"}), 400
+def alert_problem(data):
+    """Why `data` cannot be queued as an alert, or None if it can."""
+    if not isinstance(data, dict):
+        return "alert must be a JSON object"
+    # alerts are keyed by patient, so an alert without a real id would overwrite another
+    patient_id = data.get("patient_id")
+    if not isinstance(patient_id, str) or not patient_id.strip():
+        return "patient_id must be a non-empty string"
+    try:
+        int(data.get("score", 0))
+    except (TypeError, ValueError):
+        return f"score must be an integer, got {data.get('score')!r}"
+    return None
 
-    entry = {
-        "patient_id": data.get("patient_id", "unknown"),
+def make_entry(data):
+    return {
+        "patient_id": data["patient_id"],
         "name": data.get("name", "unknown"),
         "score": int(data.get("score", 0)),
         "priority": data.get("priority", "unknown"),
         "rationale": data.get("rationale", ""),
+        # "encounter" from the robot, "prescreen" from an EHR-only round
+        "source": data.get("source", "encounter"),
         "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
     }
 
-    heapq.heappush(alerts, (-entry["score"], entry))
-    save_alerts()
+def queue_entries(entries):
+    """Upsert alerts, journal them with one fsync and publish them to the feed.
+
+    Returns the entries actually queued: a pre-screen alert is dropped when
+    the patient already has a higher-scoring alert.
+    """
+    with alerts_lock:
+        queued = []
+        for entry in entries:
+            current = alerts.get(entry["patient_id"])
+            if entry["source"] == "prescreen" and current is not None and current["score"] > entry["score"]:
+                continue
+            # a newer alert for the same patient replaces the old one
+            alerts.upsert(entry)
+            queued.append(entry)
+        if not queued:
+            return queued
+        journal.append_many([{"op": "add", "entry": entry} for entry in queued])
+        for entry in queued:
+            feed.publish("upsert", patient_id=entry["patient_id"], entry=entry)
+        if journal.needs_compaction():
+            save_alerts()
+    return queued
+
+@app.route("/alert", methods=["POST"])
+def receive_alert():
+    """Receive critical patient alert from Edison."""
+    data = request.get_json(force=True)
+    if not data:
+        return jsonify({"status": "error", "msg": "No data received"}), 400
+    problem = alert_problem(data)
+    if problem:
+        return jsonify({"status": "error", "msg": problem}), 400
+
+    entry = make_entry(data)
+    queue_entries([entry])
 
     print(f"[ALERT RECEIVED] {entry}")
     return jsonify({"status": "ok", "msg": "Alert queued"})
 
+@app.route("/alerts/bulk", methods=["POST"])
+def receive_alerts_bulk():
+    """Queue many alerts at once (e.g. an overnight pre-screening round)."""
+    data = request.get_json(force=True)
+    if not isinstance(data, list) or not data:
+        return jsonify({"status": "error", "msg": "Expected a non-empty list of alerts"}), 400
+    # check everything first, so a bad item queues nothing
+    for index, item in enumerate(data):
+        problem = alert_problem(item)
+        if problem:
+            return jsonify({"status": "error", "msg": f"Alert {index}: {problem}", "index": index}), 400
+
+    entries = [make_entry(item) for item in data]
+    queued = queue_entries(entries)
+    skipped = len(entries) - len(queued)
+
+    print(f"[ALERTS RECEIVED] {len(queued)} alerts in bulk ({skipped} kept a higher existing alert)")
+    return jsonify({"status": "ok", "msg": f"{len(queued)} alerts queued",
+                    "count": len(queued), "skipped": skipped})
+
 @app.route("/alerts", methods=["GET"])
 def get_alerts():
     """Return the current alert queue sorted by score (highest first)."""
-    sorted_alerts = [entry for (_, entry) in sorted(alerts)]
-    return jsonify(sorted_alerts)
+    if request.headers.get("If-None-Match") == feed.etag:
+        return Response(status=304, headers={"ETag": feed.etag})
+    with alerts_lock:
+        body = alerts.sorted_json()
+        etag = feed.etag
+    return Response(body, mimetype="application/json", headers={"ETag": etag})
+
+def feed_snapshot():
+    """Full queue plus the feed position it corresponds to (caller holds alerts_lock)."""
+    return {"reset": True, "epoch": feed.epoch, "seq": feed.seq, "alerts": alerts.sorted_view()}
+
+@app.route("/alerts/changes", methods=["GET"])
+def alert_changes():
+    """Changes after ?since=<seq>&epoch=<epoch>, or the full queue if too far behind."""
+    if request.headers.get("If-None-Match") == feed.etag:
+        return Response(status=304, headers={"ETag": feed.etag})
+    since = request.args.get("since", default=-1, type=int)
+    epoch = request.args.get("epoch")
+    with alerts_lock:
+        changes = feed.since(since, epoch) if since >= 0 else None
+        if changes is None:
+            body = feed_snapshot()
+        else:
+            body = {"epoch": feed.epoch, "seq": feed.seq, "changes": changes}
+        etag = feed.etag
+    resp = jsonify(body)
+    resp.headers["ETag"] = etag
+    return resp
+
+@app.route("/alerts/stream", methods=["GET"])
+def alert_stream():
+    """Server-Sent Events: a snapshot or catch-up changes, then each change as it happens."""
+    since = request.args.get("since", default=-1, type=int)
+    if request.headers.get("Last-Event-ID", "").isdigit():
+        since = int(request.headers["Last-Event-ID"])
+    epoch = request.args.get("epoch")
+
+    def event(data, seq=None):
+        prefix = f"id: {seq}\n" if seq is not None else ""
+        return f"{prefix}data: {json.dumps(data)}\n\n"
+
+    def events():
+        with alerts_lock:
+            changes = feed.since(since, epoch) if since >= 0 else None
+            snapshot = feed_snapshot() if changes is None else None
+            seq = feed.seq
+        if snapshot is not None:
+            yield event(snapshot, seq)
+        for change in changes or []:
+            yield event(change, change["seq"])
+        while True:
+            changes = feed.wait(seq, timeout=15)
+            if not changes:
+                yield ": keep-alive\n\n"
+                continue
+            if changes[0]["seq"] > seq + 1:
+                # fell behind the retained log; start over from a snapshot
+                with alerts_lock:
+                    snapshot, seq = feed_snapshot(), feed.seq
+                yield event(snapshot, seq)
+                continue
+            for change in changes:
+                yield event(change, change["seq"])
+            seq = changes[-1]["seq"]
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache"})
+
+@app.route("/alerts/<patient_id>/ack", methods=["POST"])
+def acknowledge_alert(patient_id):
+    """HCP acknowledged one patient's alert; remove it from the queue."""
+    entry = remove_alert(patient_id)
+    if entry is None:
+        return jsonify({"status": "error", "msg": "No alert for patient"}), 404
+    return jsonify({"status": "ok", "msg": "Alert acknowledged", "alert": entry})
+
+@app.route("/alerts/<patient_id>", methods=["DELETE"])
+def delete_alert(patient_id):
+    """Remove one patient's alert without acknowledging it."""
+    entry = remove_alert(patient_id)
+    if entry is None:
+        return jsonify({"status": "error", "msg": "No alert for patient"}), 404
+    return jsonify({"status": "ok", "msg": "Alert removed"})
 
 @app.route("/clear", methods=["POST"])
 def clear_alerts():
     """Clear the alert queue (after HCP acknowledgment)."""
-    alerts.clear()
-    save_alerts()
+    with alerts_lock:
+        alerts.clear()
+        save_alerts()
+        feed.publish("clear")
     return jsonify({"status": "ok", "msg": "Queue cleared"})
 
 if __name__ == "__main__":
     load_alerts()
-    app.run(host="0.0.0.0", port=8001)
+    app.run(host="0.0.0.0", port=8001, threaded=True)
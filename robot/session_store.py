@@ -0,0 +1,147 @@
+"""Triage session stores with idle TTL, LRU capacity and eviction metrics.
+
+A session is a JSON-able dict ({"ehr": ..., "history": [...]}) keyed by
+patient id. Both stores expose the same small API:
+
+    get_or_create(patient_id, ehr) -> session
+    save(patient_id, session)       # persist after mutating
+    delete(patient_id)              # conversation finished
+    stats()
+
+Sessions idle longer than `ttl` seconds expire, and once `capacity` is
+reached the least recently used session is evicted. SQLiteSessionStore keeps
+sessions on disk so a restarted server can resume a conversation.
+"""
+import json, os, sqlite3, threading, time
+from collections import OrderedDict
+
+# set TRIAGE_SESSION_DB to a file path to keep sessions across restarts
+SESSION_DB = os.environ.get("TRIAGE_SESSION_DB")
+SESSION_TTL = float(os.environ.get("TRIAGE_SESSION_TTL", 15 * 60))
+SESSION_CAPACITY = int(os.environ.get("TRIAGE_SESSION_CAPACITY", 256))
+
+
+class MemorySessionStore:
+    def __init__(self, ttl=SESSION_TTL, capacity=SESSION_CAPACITY):
+        self.ttl = ttl
+        self.capacity = capacity
+        # patient_id -> (session, last_used); ordered oldest use first
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = {"created": 0, "resumed": 0, "ended": 0, "expired": 0, "evicted": 0}
+
+    def _sweep(self, now):
+        while self._sessions:
+            pid, (_, last_used) = next(iter(self._sessions.items()))
+            if now - last_used < self.ttl:
+                break
+            del self._sessions[pid]
+            self.metrics["expired"] += 1
+
+    def get_or_create(self, patient_id, ehr):
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            if patient_id in self._sessions:
+                session, _ = self._sessions.pop(patient_id)
+                self.metrics["resumed"] += 1
+            else:
+                session = {"ehr": ehr, "history": []}
+                self.metrics["created"] += 1
+                while len(self._sessions) >= self.capacity:
+                    self._sessions.popitem(last=False)
+                    self.metrics["evicted"] += 1
+            self._sessions[patient_id] = (session, now)
+            return session
+
+    def save(self, patient_id, session):
+        with self._lock:
+            self._sessions.pop(patient_id, None)
+            self._sessions[patient_id] = (session, time.time())
+
+    def delete(self, patient_id):
+        with self._lock:
+            if self._sessions.pop(patient_id, None) is not None:
+                self.metrics["ended"] += 1
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def stats(self):
+        with self._lock:
+            self._sweep(time.time())
+            return dict(self.metrics, size=len(self._sessions), capacity=self.capacity, ttl=self.ttl)
+
+
+class SQLiteSessionStore:
+    """Same policy as MemorySessionStore, persisted in a SQLite file."""
+
+    def __init__(self, path, ttl=SESSION_TTL, capacity=SESSION_CAPACITY):
+        self.ttl = ttl
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " patient_id TEXT PRIMARY KEY, data TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions(last_used)")
+        self.metrics = {"created": 0, "resumed": 0, "ended": 0, "expired": 0, "evicted": 0}
+
+    def _sweep(self, now):
+        cur = self._db.execute("DELETE FROM sessions WHERE last_used <= ?", (now - self.ttl,))
+        self.metrics["expired"] += cur.rowcount
+
+    def get_or_create(self, patient_id, ehr):
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            row = self._db.execute(
+                "SELECT data FROM sessions WHERE patient_id = ?", (patient_id,)).fetchone()
+            if row:
+                session = json.loads(row[0])
+                self.metrics["resumed"] += 1
+            else:
+                session = {"ehr": ehr, "history": []}
+                self.metrics["created"] += 1
+                (size,) = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()
+                overflow = size - self.capacity + 1
+                if overflow > 0:
+                    self._db.execute(
+                        "DELETE FROM sessions WHERE patient_id IN ("
+                        " SELECT patient_id FROM sessions ORDER BY last_used LIMIT ?)", (overflow,))
+                    self.metrics["evicted"] += overflow
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (patient_id, data, last_used) VALUES (?, ?, ?)",
+                (patient_id, json.dumps(session), now))
+            return session
+
+    def save(self, patient_id, session):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (patient_id, data, last_used) VALUES (?, ?, ?)",
+                (patient_id, json.dumps(session), time.time()))
+
+    def delete(self, patient_id):
+        with self._lock:
+            cur = self._db.execute("DELETE FROM sessions WHERE patient_id = ?", (patient_id,))
+            self.metrics["ended"] += cur.rowcount
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def stats(self):
+        with self._lock:
+            self._sweep(time.time())
+            (size,) = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()
+            return dict(self.metrics, size=size, capacity=self.capacity, ttl=self.ttl)
+
+
+def make_session_store(db_path=SESSION_DB, ttl=SESSION_TTL, capacity=SESSION_CAPACITY):
+    """SQLite-backed store if `db_path` is given, otherwise in-memory."""
+    if db_path:
+        return SQLiteSessionStore(db_path, ttl=ttl, capacity=capacity)
+    return MemorySessionStore(ttl=ttl, capacity=capacity)
@@ -1,16 +1,37 @@
 #!/usr/bin/env python3
-import cv2, time, json, requests, subprocess, platform, serial
+import cv2, time, json, requests, serial, threading, traceback
+from concurrent.futures import ThreadPoolExecutor
 import serial.tools.list_ports
-from vosk import Model, KaldiRecognizer
-import pandas as pd
-from ehr_parser import get_patient_context, get_full_name
+from vosk import Model
+from asr import SpeechListener
+from face_pipeline import FacePipeline
+from serial_worker import SerialWorker
+from tts import FIXED_PHRASES, GOODBYE, GREETING, READY, SCORE, Speaker
+from ehr_parser import context_cache, estimate_tokens, get_full_name, loader
+from triage_rules import patient_facts
 
 CONFIG = {
     "server_url": "http://127.0.0.1:8000/triage",   # Flask server + Ollama
     "vosk_model": "./vosk-model-small-en-us-0.15",
     "camera_index": 0,
+    # face detection cost: detect on a `face_scale` copy every Nth frame, track in between
+    "face_scale": 0.5,
+    "face_detect_every": 5,
+    "face_min_size": 60,         # smallest face, in full-resolution pixels
     "haar_cascade": "{cv2_haar}/haarcascade_frontalface_default.xml",
-    "esp32_baud": 115200
+    "esp32_baud": 115200,
+    "esp32_port": None,          # None = auto-detect; any pyserial URL, e.g. "loop://"
+    "esp32_ack_timeout": 1.5,
+    "stream": True,  # speak each sentence of a question as soon as it is generated
+    # between patients, build the next patient's context ahead of time
+    "prefetch": True,
+    # upcoming patients whose contexts are kept warm (at most the context cache's capacity)
+    "context_window": 64,
+    # answer endpointing: stop listening after this much quiet once speech started
+    "asr_end_silence": 0.8,
+    "asr_start_timeout": 6.0,    # give up if nobody speaks
+    "asr_max_seconds": 15.0,     # cap on one answer
+    "asr_rms_threshold": 500,    # 16-bit RMS that counts as voice
 }
 
 # connect to mcu
@@ -23,119 +44,251 @@ def find_esp32_port():
             return port
     return None
 
-# serial protocol
-try:
-    esp32_port = find_esp32_port()
-    if esp32_port:
-        ser = serial.Serial(esp32_port, CONFIG["esp32_baud"], timeout=1)
-        time.sleep(2)  
-        print("[ESP32] Connected on", esp32_port)
-        
-        ser.write(b"LOW\n")
-        time.sleep(0.5)
-        if ser.in_waiting:
-            response = ser.readline().decode().strip()
-            print(f"[ESP32] Startup initialization: {response}")
-        print("[ESP32] GPIO initialized to LOW")
-    else:
-        ser = None
-        print("[ESP32] No ESP32 port found")
-except Exception as e:
-    ser = None
-    print("[ESP32] Serial not available:", e)
+# serial protocol: a background worker owns the port, so GPIO never blocks the loop
+gpio = SerialWorker(CONFIG["esp32_port"], CONFIG["esp32_baud"], find_port=find_esp32_port,
+                    ack_timeout=CONFIG["esp32_ack_timeout"], initial=["LOW"])
 
 def send_gpio(cmd):
-    """Send HIGH/LOW to ESP32 over serial."""
-    if ser:
-        try:
-            ser.write((cmd + "\n").encode())
-            time.sleep(1)  
-            if ser.in_waiting:
-                response = ser.readline().decode().strip()
-                print(f"[ESP32] Response: {response}")
-            print(f"[ESP32] Sent: {cmd}")
-        except Exception as e:
-            print("[ESP32] Send failed:", e)
-
-
-if platform.system() == "Darwin":
-    TTS_CMD = "say"
-else:
-    TTS_CMD = "espeak"
-
-def say(text):
-    if not text:
-        return
-    try:
-        subprocess.run([TTS_CMD, text], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    except Exception:
-        print(f"[TTS skipped] {text}")
-
-def shutil_which(cmd):
-    from shutil import which
-    return which(cmd) is not None
-
+    """Queue HIGH/LOW for the ESP32 and return at once (a Future of the ack line)."""
+    return gpio.send(cmd)
+
+
+# speech: rendered clips are cached on disk and played on a background thread
+speaker = Speaker()
+
+def say(text, cache=True):
+    """Queue `text` for speaking; returns before it has been said."""
+    speaker.say(text, cache)
+
+def stream_triage(payload):
+    """POST a streaming /triage turn, speaking sentences as they arrive.
+
+    Returns the final event (next_question or verdict) like the JSON route.
+    """
+    start = time.time()
+    first_sentence = None
+    result = {}
+    with requests.post(CONFIG["server_url"], json=dict(payload, stream=True),
+                       stream=True, timeout=60) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data: "):
+                continue
+            event = json.loads(line[len("data: "):])
+            if "sentence" in event:
+                if first_sentence is None:
+                    first_sentence = time.time() - start
+                say(event["sentence"], cache=False)
+            elif event.get("done"):
+                result = event
+                break
+    total = time.time() - start
+    if first_sentence is not None:
+        print(f"[LATENCY] first sentence {first_sentence:.2f}s, full reply {total:.2f}s")
+    else:
+        print(f"[LATENCY] reply {total:.2f}s (nothing spoken while streaming)")
+    return result
 
 vosk_model = Model(CONFIG["vosk_model"])
-
-def ask(prompt, seconds=4):
-    say(prompt)
+listener = SpeechListener(vosk_model, rms_threshold=CONFIG["asr_rms_threshold"],
+                          start_timeout=CONFIG["asr_start_timeout"],
+                          end_silence=CONFIG["asr_end_silence"],
+                          max_seconds=CONFIG["asr_max_seconds"])
+
+def ask(prompt, speak=True):
+    if speak:
+        say(prompt, cache=False)
+    speaker.wait()   # don't listen while the robot is still talking
     print("Q:", prompt)
-    rec = KaldiRecognizer(vosk_model, 16000)
-
-    if shutil_which("arecord"):
-        cmd = ["arecord","-q","-d",str(seconds),"-f","S16_LE","-r","16000","-c","1"]
-    elif shutil_which("rec"):
-        cmd = [
-            "rec", "-q", "-c", "1", "-b", "16", "-r", "16000",
-            "-e", "signed-integer", "-t", "raw", "-", "trim", "0", str(seconds)
-        ]
-    else:
+
+    if not listener.available:
         return input("Type answer: ")
 
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
-    text = ""
-    while True:
-        data = proc.stdout.read(4000)
-        if not data:
-            break
-        if rec.AcceptWaveform(data):
-            part = json.loads(rec.Result()).get("text", "")
-            text += " " + part
-    part = json.loads(rec.FinalResult()).get("text", "")
-    text += " " + part
-    ans = text.strip()
-    print("A:", ans)
+    start = time.time()
+    ans = listener.listen()
+    print(f"A: {ans}  [{time.time() - start:.1f}s]")
     return ans
 
-# face detection
+# face detection: capture and (downscaled, throttled) detection run on their own threads
 haar = CONFIG["haar_cascade"].replace("{cv2_haar}", cv2.data.haarcascades)
-cap = cv2.VideoCapture(CONFIG["camera_index"])
-cascade = cv2.CascadeClassifier(haar)
+faces_pipeline = FacePipeline(CONFIG["camera_index"], cascade_path=haar,
+                              scale=CONFIG["face_scale"],
+                              detect_every=CONFIG["face_detect_every"],
+                              min_size=CONFIG["face_min_size"])
 
-# Load patient list once
-patients_df = pd.read_csv("patients.csv")
+# Round list from the same data directory the contexts are built from
+patients_df = loader.patients
 patient_index = 0
 
-say("Triage system ready. Waiting for a patient.")
+# Render fixed phrases and the round's greetings once, off the critical path
+threading.Thread(target=speaker.prerender, daemon=True, args=(
+    FIXED_PHRASES + [GREETING.format(name=get_full_name(row)) for _, row in patients_df.iterrows()],
+)).start()
+
+say(READY)
 cooldown_until = 0
 face_cleared = True   
 
+def prepare_encounter(index):
+    """Context and rule facts for patients_df row `index`."""
+    row = patients_df.iloc[index]
+    pid = str(row["Id"])
+    ehr_dict = context_cache.get(pid)
+    # structured vitals for the server's rules, which may run on a host without the CSVs
+    facts = patient_facts(pid)
+    return {"index": index, "pid": pid, "name": get_full_name(row), "ehr": ehr_dict, "facts": facts}
+
+prefetch_pool = ThreadPoolExecutor(max_workers=1)
+next_encounter = None   # Future of prepare_encounter for the upcoming patient
+
+def prefetch_next():
+    """Use idle time to prepare the next patient in the round."""
+    global next_encounter
+    next_encounter = None
+    # keep the contexts of the next few patients rendered; only newcomers to the window are built
+    upcoming = patients_df["Id"].iloc[patient_index:patient_index + CONFIG["context_window"]]
+    if len(upcoming):
+        prefetch_pool.submit(context_cache.precompute, upcoming.astype(str).tolist())
+    if CONFIG["prefetch"] and patient_index < len(patients_df):
+        next_encounter = prefetch_pool.submit(prepare_encounter, patient_index)
+
+def take_prepared():
+    """The prefetched encounter for the current patient, or None if it is unusable."""
+    if next_encounter is None:
+        return None
+    try:
+        prepared = next_encounter.result()
+    except Exception as e:
+        print("[PREFETCH] Failed:", e)
+        return None
+    if prepared["index"] != patient_index:
+        return None
+    prepared["prefetched"] = True
+    return prepared
+
+def converse():
+    """Greet the next patient, run the triage conversation and queue its alert."""
+    global patient_index
+    started = time.time()
+    send_gpio("HIGH")   
+
+    resp = None
+    prepared = None
+    if patient_index < len(patients_df):
+        prepared = take_prepared() or prepare_encounter(patient_index)
+        pid, name, ehr_dict, facts = prepared["pid"], prepared["name"], prepared["ehr"], prepared["facts"]
+        print(f"[EHR] Context for {pid}: ~{estimate_tokens(ehr_dict)} tokens")
+        patient_index += 1
+    else:
+        pid = f"anon-{int(time.time())}"
+        ehr_dict = {"note": "No more patients in dataset"}
+        facts = None
+        name = "Anonymous"
+
+    # say() returns at once, so the opening /triage turn below runs while the greeting plays
+    say(GREETING.format(name=name))
+
+    answer = ""
+    first_question = None
+    while True:
+        streamed = False
+        if resp is None:
+            try:
+                payload = {"patient_id": pid, "ehr": ehr_dict, "facts": facts, "answer": answer}
+                if CONFIG["stream"]:
+                    resp = stream_triage(payload)
+                    streamed = True
+                else:
+                    resp = requests.post(CONFIG["server_url"], json=payload, timeout=60).json()
+            except Exception as e:
+                print("Error contacting server:", e)
+                break
+
+        if "next_question" in resp:
+            q = resp["next_question"]
+            if first_question is None:
+                first_question = time.time() - started
+            resp = None
+            answer = ask(q, speak=not streamed)
+            continue
+        elif "emergency_index" in resp:
+            speaker.wait()
+            score = int(resp.get("emergency_index", 0))
+            # the server applies the critical threshold (critical_score in triage_config.yaml)
+            priority = resp.get("priority_label", "low")
+
+            rationale = resp.get("rationale", "")
+            print("Triage result:", resp)
+            say(SCORE.format(score=score, priority=priority))
+
+
+            alert_payload = {
+                "patient_id": pid,
+                "name": name,
+                "score": score,
+                "priority": priority,
+                "rationale": rationale,
+            }
+            try:
+                r = requests.post("http://127.0.0.1:8001/alert", json=alert_payload, timeout=5)
+                print("[QUEUE] Alert pushed:", r.json())
+            except Exception as e:
+                print("[QUEUE] Failed to push alert:", e)
+
+            break
+        elif "error" in resp:
+            # nothing to say to the resident; end the check-in without a score
+            print("[TRIAGE] Server error:", resp["error"])
+            break
+        else:
+            print("Unexpected response:", resp)
+            break
+
+    say(GOODBYE)
+    print(f"[ENCOUNTER] {pid}: first question after "
+          + (f"{first_question:.1f}s" if first_question is not None else "-")
+          + f", total {time.time() - started:.1f}s"
+          + f" (prefetched: {bool(prepared and prepared.get('prefetched'))})")
+    print("[EHR] Context cache:", context_cache.stats())
+    print("[FACE]", faces_pipeline.stats())
+    print("[TTS]", speaker.metrics)
+
+def run_encounter():
+    """One triage conversation; runs off the UI thread so video keeps updating.
+
+    However the conversation ends, the motors are switched off and the
+    cooldown is armed, so a failure cannot leave GPIO HIGH or retrigger at once.
+    """
+    global cooldown_until, face_cleared
+    try:
+        converse()
+    except Exception:
+        print("[ENCOUNTER] Failed:")
+        traceback.print_exc()
+    finally:
+        prefetch_next()   # prepare the next patient during the cooldown
+        cooldown_until = time.time() + 10
+        send_gpio("LOW")
+        face_cleared = False   # Must clear before another patient triggers
+
+prefetch_next()
+encounter = None
+frame_seq = 0
 while True:
-    ok, frame = cap.read()
-    if not ok:
+    frame_seq, frame, faces = faces_pipeline.latest(after=frame_seq)
+    if frame is None:
         continue
-
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    faces = cascade.detectMultiScale(gray, 1.2, 5, minSize=(60,60))
+    frame = frame.copy()
 
     for (x,y,w,h) in faces:
         cv2.rectangle(frame,(x,y),(x+w,y+h),(0,255,0),2)
 
     now = time.time()
+    in_encounter = encounter is not None and encounter.is_alive()
 
-    if now < cooldown_until:
-        cv2.putText(frame, "Moving to next patient...", (30,30),
+    if in_encounter or now < cooldown_until:
+        status = "Triage in progress..." if in_encounter else "Moving to next patient..."
+        cv2.putText(frame, status, (30,30),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0,0,255), 2)
         cv2.imshow("Triage Face", frame)
         if cv2.waitKey(1) & 0xFF == ord('q'):
@@ -152,66 +305,8 @@ while True:
     # Only start triage if a *new* face appears and cooldown expired
     if len(faces) > 0 and face_cleared and now >= cooldown_until:
         face_cleared = False
-        send_gpio("HIGH")   
-
-        if patient_index < len(patients_df):
-            pid = str(patients_df.iloc[patient_index]["Id"])
-            ehr_dict = get_patient_context(pid)
-            name = get_full_name(patients_df.iloc[patient_index])
-            patient_index += 1
-        else:
-            pid = f"anon-{int(time.time())}"
-            ehr_dict = {"note": "No more patients in dataset"}
-            name = "Anonymous"
-
-        say(f"Hello {name}. I will use your record for this session.")
+        encounter = threading.Thread(target=run_encounter, daemon=True)
+        encounter.start()
 
-        answer = ""
-        while True:
-            try:
-                payload = {"patient_id": pid, "ehr": ehr_dict, "answer": answer}
-                resp = requests.post(CONFIG["server_url"], json=payload, timeout=60).json()
-            except Exception as e:
-                print("Error contacting server:", e)
-                break
-
-            if "next_question" in resp:
-                q = resp["next_question"]
-                answer = ask(q)
-                continue
-            elif "emergency_index" in resp:
-                score = int(resp.get("emergency_index", 0))
-
-                # Apply threshold
-                if score > 65:
-                    priority = "critical"
-                else:
-                    priority = resp.get("priority_label", "low")
-
-                rationale = resp.get("rationale", "")
-                print("Triage result:", resp)
-                say(f"Your triage score is {score}. Priority {priority}.")
-
-
-                alert_payload = {
-                    "patient_id": pid,
-                    "name": name,
-                    "score": score,
-                    "priority": priority,
-                    "rationale": rationale,
-                }
-                try:
-                    r = requests.post("http://127.0.0.1:8001/alert", json=alert_payload, timeout=5)
-                    print("[QUEUE] Alert pushed:", r.json())
-                except Exception as e:
-                    print("[QUEUE] Failed to push alert:", e)
-
-                break
-            else:
-                print("Unexpected response:", resp)
-                break
-
-        say("Thank you. I will continue rounds now.")
-        cooldown_until = time.time() + 10
-        send_gpio("LOW")    
-        face_cleared = False   # Must clear before another patient triggers
+faces_pipeline.stop()
+gpio.close()
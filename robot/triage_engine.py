@@ -0,0 +1,534 @@
+"""Triage conversation logic shared by the Flask and asyncio servers.
+
+A TriageEngine owns the LLM backend and a session store (see
+session_store) holding per-patient conversations. Each session has its own
+lock, so turns for one patient run in order while different patients
+proceed in parallel, and every model call goes through an InferenceQueue
+that caps concurrent generations and reports its depth.
+
+The model answers every turn with a typed JSON object constrained by
+TURN_SCHEMA (ask a question or give a verdict); once the question cap is
+reached the turn is constrained to VERDICT_SCHEMA instead. A reply with
+neither a question nor a verdict is regenerated once, then replaced by the
+fallback verdict. If the backend fails the turn is dropped and the client
+gets an `error` instead of a question.
+
+Before the first model call of a conversation the patient's vitals are
+checked against the rules in triage_config.yaml (see triage_rules): a
+recent critical finding returns a verdict without calling the model, a
+recent abnormal one is added to the prompt and sets a floor on the
+verdict's score, and older findings are only mentioned in the prompt. The
+vitals come from the request's `facts` when the client sends them, else
+from the EHR on this host.
+"""
+import json, re, threading, uuid, weakref
+from contextlib import contextmanager
+from json_stream import JSONFieldStream, parse_object
+from session_store import MemorySessionStore
+from triage_rules import RuleEngine, clean_facts, patient_facts
+
+MAX_QUESTIONS = 5
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+PRIORITY_LABELS = ["low", "medium", "high", "critical"]
+
+VERDICT_PROPERTIES = {
+    "emergency_index": {"type": "integer", "minimum": 0, "maximum": 100},
+    "priority_label": {"type": "string", "enum": PRIORITY_LABELS},
+    "rationale": {"type": "string"},
+}
+
+VERDICT_SCHEMA = {
+    "type": "object",
+    "properties": VERDICT_PROPERTIES,
+    "required": list(VERDICT_PROPERTIES),
+}
+
+ASK_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "action": {"type": "string", "enum": ["ask"]},
+        "question": {"type": "string", "minLength": 1},
+    },
+    "required": ["action", "question"],
+}
+
+# either branch requires its own fields, so "ask" always carries a question
+TURN_SCHEMA = {
+    "anyOf": [
+        ASK_SCHEMA,
+        {
+            "type": "object",
+            "properties": dict({"action": {"type": "string", "enum": ["verdict"]}},
+                               **VERDICT_PROPERTIES),
+            "required": ["action"] + list(VERDICT_PROPERTIES),
+        },
+    ],
+}
+
+# extra generations for a reply that neither asks nor decides
+REPLY_RETRIES = 1
+
+def split_sentences(buffer):
+    """Split off complete sentences; return (sentences, unfinished remainder)."""
+    parts = SENTENCE_END.split(buffer)
+    return [p.strip() for p in parts[:-1] if p.strip()], parts[-1]
+
+def sse(event):
+    return f"data: {json.dumps(event)}\n\n"
+
+JSON_FORMAT = """{
+  "action": "verdict",
+  "emergency_index": number 0–100,
+  "priority_label": "low|medium|high|critical",
+  "rationale": "short explanation"
+}"""
+
+QUESTION_FORMAT = """{"action": "ask", "question": "what you say to the patient"}"""
+
+def build_system_prompt(ehr):
+    # Everything that never changes during a conversation goes here, so the
+    # model can reuse its cached prefix and only evaluate the newest turn.
+    return f"""
+You are a clinical triage assistant robot.
+
+Context:
+- Patient EHR: {json.dumps(ehr)}
+- Your goal is to check on the patient, clarify symptoms, and decide urgency.
+- Do not read out the patient id.
+- Do not talk in third person. There's only 2 people: you and the patient.
+- Be conversational. If the patient says "maybe" or vague answers, ask a clarifying question.
+- Your maximum number of follow up questions is 5.
+- Keep it short: no more than 2–3 follow-ups.
+- DO NOT REPEAT THE SAME THING MULTIPLE TIMES.
+- Always reply with a single JSON object.
+
+After each patient message either:
+1. Ask the next question if more info is needed (but only if you’ve asked fewer than 5 questions total):
+{QUESTION_FORMAT}
+2. Or if you have enough info, output the JSON triage summary:
+{JSON_FORMAT}
+"""
+
+VERDICT_FORMAT = JSON_FORMAT.replace('  "action": "verdict",\n', "")
+
+OPENING_MESSAGE = "(The patient is in front of you. Start the check-in.)"
+
+FINAL_MESSAGE = f"""
+You have already asked 5 follow-up questions.
+Now you MUST STOP asking questions and output ONLY the final triage summary.
+
+Output ONLY a JSON object in this exact format:
+{VERDICT_FORMAT}
+"""
+
+PRESCREEN_MESSAGE = f"""
+This is an overnight pre-screening from the record alone; the patient cannot answer questions.
+Based only on the EHR, output ONLY a JSON object in this exact format:
+{VERDICT_FORMAT}
+"""
+
+def findings_note(assessment):
+    """Prompt addendum describing rule findings, or "" if there are none."""
+    if not assessment:
+        return ""
+    note = ""
+    if assessment["severity"]:
+        flagged = "\n".join(f"- {f['text']}" for f in assessment["findings"])
+        note += (f"\nAutomated vitals checks flagged:\n{flagged}\n"
+                 f"Ask about these. Your emergency_index must be at least {assessment['score']}.\n")
+    if assessment.get("stale"):
+        older = "\n".join(f"- {f['text']}" for f in assessment["stale"])
+        note += (f"\nOlder readings outside the normal range (history only, not current):\n{older}\n"
+                 "Ask whether these problems are still present.\n")
+    return note
+
+def build_messages(ehr, history, final=False, system=None):
+    """Chat messages for a conversation: a fixed prefix plus one message per turn.
+
+    Earlier turns are rendered identically every time, so each request only
+    adds the newest turn on top of a prefix the model has already processed.
+    Pass the already rendered `system` prompt to skip re-serializing the EHR.
+    """
+    messages = [
+        {"role": "system", "content": system or build_system_prompt(ehr)},
+        {"role": "user", "content": OPENING_MESSAGE},
+    ]
+    for h in history:
+        if "patient" in h:
+            messages.append({"role": "user", "content": h["patient"]})
+        else:
+            # replay the model's own JSON so the cached prefix matches exactly
+            messages.append({"role": "assistant", "content": h.get("raw", h["assistant"])})
+    if final:
+        messages.append({"role": "user", "content": FINAL_MESSAGE})
+    return messages
+
+FALLBACK_VERDICT = {
+    "emergency_index": 65,
+    "priority_label": "medium",
+    "rationale": "Unsure what symptoms mean, insufficient info, defaulting to 65",
+    "fallback": True
+}
+
+def label_for(score):
+    """Priority band for a score when the model omitted or garbled the label."""
+    return PRIORITY_LABELS[min(3, max(0, int(score)) // 25)]
+
+def to_verdict(turn):
+    """Normalize a typed reply into the verdict the client expects, or None."""
+    try:
+        score = max(0, min(100, int(turn["emergency_index"])))
+    except (KeyError, TypeError, ValueError):
+        return None
+    label = str(turn.get("priority_label", "")).lower()
+    return {
+        "emergency_index": score,
+        "priority_label": label if label in PRIORITY_LABELS else label_for(score),
+        "rationale": str(turn.get("rationale", "")),
+    }
+
+def read_turn(reply, turn, final):
+    """("verdict", verdict), ("ask", question), or (None, None) if the reply is unusable.
+
+    The model's `action` decides; only a reply without one (a backend with no
+    structured output) is read as a verdict when it has an emergency_index,
+    or as a plain-text question otherwise.
+    """
+    turn = turn or {}
+    action = turn.get("action")
+    if final or action == "verdict" or (action is None and "emergency_index" in turn):
+        verdict = to_verdict(turn)
+        return ("verdict", verdict) if verdict is not None else (None, None)
+    question = str(turn.get("question") or "").strip()
+    if not question and action is None and not reply.startswith("{"):
+        question = reply
+    return ("ask", question) if question else (None, None)
+
+
+class BackendError(Exception):
+    """The LLM backend failed, so the turn has no reply."""
+
+
+class InferenceQueue:
+    """Caps concurrent LLM generations; `depth` is how many calls are waiting."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.active = 0
+        self.completed = 0
+
+    @contextmanager
+    def slot(self):
+        with self._lock:
+            self.waiting += 1
+        self._slots.acquire()
+        with self._lock:
+            self.waiting -= 1
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+            self._slots.release()
+
+    @property
+    def depth(self):
+        return self.waiting
+
+    def stats(self):
+        with self._lock:
+            return {"limit": self.limit, "waiting": self.waiting,
+                    "active": self.active, "completed": self.completed}
+
+
+class TriageEngine:
+    def __init__(self, backend, concurrency=2, sessions=None, rules=None, facts=patient_facts):
+        self.backend = backend
+        self.inference = InferenceQueue(concurrency)
+        # Store conversation history per patient
+        self.sessions = sessions if sessions is not None else MemorySessionStore()
+        # locks disappear on their own once no turn holds them
+        self._session_locks = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+        # vitals fast path: `facts(patient_id)` feeds the rules (see triage_rules)
+        self.rules = rules if rules is not None else RuleEngine.from_yaml()
+        self.facts = facts
+        self.rule_metrics = {"assessed": 0, "short_circuited": 0, "pre_seeded": 0,
+                             "prescreen_short_circuited": 0,
+                             "conversations": 0, "conversation_llm_calls": 0}
+
+    # Helper to run Ollama!
+    def call_ollama(self, messages, schema=None):
+        try:
+            with self.inference.slot():
+                return self.backend.chat(messages, schema=schema)
+        except Exception as e:
+            raise BackendError(str(e)) from e
+
+    def stream_ollama(self, messages, schema=None):
+        """Yield reply fragments as the model produces them."""
+        try:
+            with self.inference.slot():
+                yield from self.backend.stream_chat(messages, schema=schema)
+        except Exception as e:
+            raise BackendError(str(e)) from e
+
+    @contextmanager
+    def session_lock(self, patient_id):
+        """Serialize turns of one conversation without blocking other patients."""
+        with self._lock:
+            lock = self._session_locks.get(patient_id)
+            if lock is None:
+                lock = self._session_locks[patient_id] = threading.Lock()
+        with lock:
+            yield
+
+    def assess(self, patient_id, facts=None):
+        """Run the vitals rules for a patient; None when there is nothing to check.
+
+        `facts` sent by the client win over a lookup in this host's EHR;
+        facts that cannot be used fall back to that lookup.
+        """
+        if not self.rules.rules:
+            return None
+        if facts is not None:
+            try:
+                facts = clean_facts(facts)
+            except ValueError as e:
+                print(f"[RULES] Ignoring facts sent for {patient_id}: {e}")
+                facts = None
+        if facts is None and self.facts is not None:
+            try:
+                facts = self.facts(patient_id)
+            except Exception as e:
+                print(f"[RULES] Vitals lookup failed for {patient_id}: {e}")
+        if facts is None:
+            print(f"[RULES] No vitals for {patient_id} in the request or the local EHR; rules are off")
+            return None
+        try:
+            assessment = self.rules.evaluate(facts)
+        except Exception as e:
+            # never leave the session without a "rules" entry and fail every retry
+            print(f"[RULES] Could not evaluate vitals for {patient_id}: {e}")
+            return None
+        with self._lock:
+            self.rule_metrics["assessed"] += 1
+        return assessment
+
+    def _count(self, metric, n=1):
+        with self._lock:
+            self.rule_metrics[metric] += n
+
+    def fast_path(self, patient_id, session):
+        """Verdict straight from a critical rule finding, or None to ask the model."""
+        assessment = session.get("rules")
+        if not assessment or assessment["severity"] != "critical" or session.get("llm_calls"):
+            return None
+        self.sessions.delete(patient_id)
+        self._count("short_circuited")
+        verdict = self.rules.fast_verdict(assessment)
+        print(f"[RULES] {patient_id}: {verdict['rationale']}")
+        return verdict
+
+    def apply_rules(self, verdict, assessment):
+        """Score floor from the rules, a matching priority band, then the critical override."""
+        raised = self.rules.raise_to_floor(verdict, assessment)
+        if raised is not verdict:
+            band = label_for(raised["emergency_index"])
+            if PRIORITY_LABELS.index(band) > PRIORITY_LABELS.index(raised["priority_label"]):
+                raised["priority_label"] = band
+        return self.rules.label(raised)
+
+    @staticmethod
+    def request_problem(data):
+        """Why `data` cannot be run as a /triage turn, or None (servers answer 400)."""
+        if not isinstance(data, dict):
+            return "request body must be a JSON object"
+        if data.get("facts") is not None:
+            try:
+                clean_facts(data["facts"])
+            except ValueError as e:
+                return str(e)
+        return None
+
+    def start_turn(self, patient_id, ehr, answer, facts=None):
+        """Record the patient's answer and return the session."""
+        # Initialize session if new (or resume a stored one)
+        session = self.sessions.get_or_create(patient_id, ehr)
+        if "rules" not in session:
+            # checked once, before the first model call
+            session["rules"] = self.assess(patient_id, facts)
+            if session["rules"] and session["rules"]["severity"] == "abnormal":
+                self._count("pre_seeded")
+            self.sessions.save(patient_id, session)
+
+        # Add patient response to history if provided
+        if answer:
+            session["history"].append({"patient": answer})
+            self.sessions.save(patient_id, session)
+        return session
+
+    @staticmethod
+    def assistant_turns(session):
+        return sum(1 for h in session["history"] if "assistant" in h)
+
+    def prepare_turn(self, session):
+        """Messages and output schema for this turn; past the cap only a verdict is allowed."""
+        final = self.assistant_turns(session) >= MAX_QUESTIONS
+        if "system" not in session:
+            # rendered once per conversation instead of json.dumps(ehr) every turn
+            session["system"] = build_system_prompt(session["ehr"]) + findings_note(session.get("rules"))
+        session["llm_calls"] = session.get("llm_calls", 0) + 1
+        messages = build_messages(session["ehr"], session["history"], final=final,
+                                  system=session["system"])
+        return messages, (VERDICT_SCHEMA if final else TURN_SCHEMA), final
+
+    def finish_turn(self, patient_id, session, reply, turn, final):
+        """Turn the model's typed reply into either a verdict or the next question."""
+        kind, value = read_turn(reply, turn, final)
+        if kind == "ask":
+            session["history"].append({"assistant": value, "raw": reply})
+            self.sessions.save(patient_id, session)
+            return {"next_question": value}
+
+        self.sessions.delete(patient_id)   # End session immediately
+        with self._lock:
+            self.rule_metrics["conversations"] += 1
+            self.rule_metrics["conversation_llm_calls"] += session.get("llm_calls", 0)
+        verdict = value
+        if verdict is None:
+            print(f"[TRIAGE] No usable reply for {patient_id}, using fallback: {reply!r}")
+            verdict = dict(FALLBACK_VERDICT)
+        return self.apply_rules(verdict, session.get("rules"))
+
+    def abandon_turn(self, patient_id, session, answer, error):
+        """The backend failed: take the answer back out of the history and report the error.
+
+        The session stays open, so the client can resend the same answer.
+        """
+        if answer and session["history"] and session["history"][-1] == {"patient": answer}:
+            session["history"].pop()
+            self.sessions.save(patient_id, session)
+        print(f"[TRIAGE] Backend failed for {patient_id}: {error}")
+        return {"error": f"LLM backend failed: {error}"}
+
+    def generate_turn(self, patient_id, session):
+        """Blocking model call for this turn, regenerated once if the reply is unusable."""
+        for attempt in range(1 + REPLY_RETRIES):
+            messages, schema, final = self.prepare_turn(session)
+            reply = self.call_ollama(messages, schema).strip()
+            turn = parse_object(reply)
+            if read_turn(reply, turn, final)[0] is not None:
+                break
+            if attempt < REPLY_RETRIES:
+                print(f"[TRIAGE] Unusable reply for {patient_id}, retrying: {reply!r}")
+        return reply, turn, final
+
+    def turn(self, data):
+        """Run one blocking /triage turn and return the JSON response."""
+        patient_id = data.get("patient_id", str(uuid.uuid4()))
+        ehr = data.get("ehr", {})
+        answer = data.get("answer", "")
+        with self.session_lock(patient_id):
+            session = self.start_turn(patient_id, ehr, answer, data.get("facts"))
+            fast = self.fast_path(patient_id, session)
+            if fast is not None:
+                return fast
+            try:
+                reply, turn, final = self.generate_turn(patient_id, session)
+            except BackendError as e:
+                return self.abandon_turn(patient_id, session, answer, e)
+            return self.finish_turn(patient_id, session, reply, turn, final)
+
+    def stream_turn(self, data):
+        """Server-Sent Events: one `sentence` event per finished sentence, then `done`.
+
+        The question field is decoded from the JSON stream as it arrives, so
+        the robot can start speaking before the object is complete. Verdicts
+        are never spoken. A reply that produced nothing to say is regenerated
+        like in turn(); a backend failure ends with an `error` event.
+        """
+        patient_id = data.get("patient_id", str(uuid.uuid4()))
+        ehr = data.get("ehr", {})
+        answer = data.get("answer", "")
+        with self.session_lock(patient_id):
+            session = self.start_turn(patient_id, ehr, answer, data.get("facts"))
+            fast = self.fast_path(patient_id, session)
+            if fast is not None:
+                yield sse(dict(fast, done=True))
+                return
+            try:
+                for attempt in range(1 + REPLY_RETRIES):
+                    messages, schema, final = self.prepare_turn(session)
+                    fields = JSONFieldStream("question")
+                    buffer, heard, spoken = "", "", False
+                    for piece in self.stream_ollama(messages, schema):
+                        text = fields.feed(piece)
+                        heard += text
+                        sentences, buffer = split_sentences(buffer + text)
+                        for sentence in sentences:
+                            spoken = True
+                            yield sse({"sentence": sentence})
+                    if buffer.strip():
+                        spoken = True
+                        yield sse({"sentence": buffer.strip()})
+
+                    reply = fields.text().strip()
+                    # keep a question that was already spoken even if the object is broken
+                    turn = fields.result() or ({"action": "ask", "question": heard} if spoken else None)
+                    if spoken or read_turn(reply, turn, final)[0] is not None:
+                        break
+                    if attempt < REPLY_RETRIES:
+                        print(f"[TRIAGE] Unusable reply for {patient_id}, retrying: {reply!r}")
+            except BackendError as e:
+                yield sse(dict(self.abandon_turn(patient_id, session, answer, e), done=True))
+                return
+
+            result = self.finish_turn(patient_id, session, reply, turn, final)
+            if not spoken and "next_question" in result:
+                # plain-text reply: nothing was streamed, so send it now
+                sentences, rest = split_sentences(result["next_question"])
+                for sentence in sentences + ([rest.strip()] if rest.strip() else []):
+                    yield sse({"sentence": sentence})
+            yield sse(dict(result, done=True))
+
+    def prescreen(self, patient_id, ehr):
+        """One verdict-only generation from the EHR alone, without a session."""
+        assessment = self.assess(patient_id)
+        if assessment and assessment["severity"] == "critical":
+            self._count("prescreen_short_circuited")
+            return self.rules.fast_verdict(assessment)
+        messages = [
+            {"role": "system", "content": build_system_prompt(ehr) + findings_note(assessment)},
+            {"role": "user", "content": PRESCREEN_MESSAGE},
+        ]
+        try:
+            reply = self.call_ollama(messages, VERDICT_SCHEMA).strip()
+        except BackendError as e:
+            reply = f"backend failed: {e}"
+        verdict = to_verdict(parse_object(reply) or {})
+        if verdict is None:
+            print(f"[TRIAGE] No usable pre-screen verdict for {patient_id}, using fallback: {reply!r}")
+            verdict = dict(FALLBACK_VERDICT)
+        return self.apply_rules(verdict, assessment)
+
+    def rule_stats(self):
+        """Fast-path counters; saved calls use the observed model calls per conversation."""
+        with self._lock:
+            stats = dict(self.rule_metrics)
+        per_conversation = (stats["conversation_llm_calls"] / stats["conversations"]
+                            if stats["conversations"] else MAX_QUESTIONS + 1)
+        stats["llm_calls_saved"] = round(stats["short_circuited"] * per_conversation
+                                         + stats["prescreen_short_circuited"])
+        return stats
+
+    def stats(self):
+        return {"sessions": self.sessions.stats(), "inference": self.inference.stats(),
+                "rules": self.rule_stats()}
@@ -0,0 +1,191 @@
+"""Deterministic vitals rules evaluated before any LLM call.
+
+Rules live in triage_config.yaml. Each one compares a patient's latest
+reading of one vital (within the EHR lookback window) against an `above`
+and/or `below` threshold:
+
+  - a `critical` finding settles the case: the engine returns a verdict
+    straight away and the model is never called
+  - an `abnormal` finding pre-seeds the conversation: the model is told
+    about it and its verdict is raised to at least the rule's `score`
+
+Both only apply to readings taken within the rule's `max_age_days`. An
+older reading that crosses a threshold is only mentioned to the model as
+history; it neither skips the conversation nor raises the score.
+
+`critical_score` replaces the client-side override: any verdict scoring
+above it is labelled critical, whoever produced it.
+
+Facts are plain JSON (see patient_facts), so a client that holds the EHR
+can send them with its /triage request to a host that does not. They pass
+through clean_facts first, which drops malformed readings one at a time.
+"""
+import math, os
+import pandas as pd
+import yaml
+import ehr_parser
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "triage_config.yaml")
+CRITICAL_SCORE = 65
+# readings older than this only add notes, unless a rule sets its own max_age_days
+MAX_AGE_DAYS = 7
+SEVERITIES = ("abnormal", "critical")
+
+
+def patient_facts(patient_id, ehr=None):
+    """Age and the latest numeric reading per vital code, or None for an unknown patient.
+
+    {"age": 71, "vitals": {"Heart rate": {"value": 88.0, "date": "2025-03-02"}, ...}}
+    """
+    ehr = ehr or ehr_parser.loader
+    store = ehr.store
+    patient = store.patient(patient_id)
+    if patient is None:
+        return None
+    age = patient.get("age")
+    vitals = {}
+    cutoff = ehr_parser.today - pd.DateOffset(years=ehr.lookback_years)
+    for description, value, date in store.observations(patient_id, store.code_ids(ehr.vital_codes),
+                                                       since=cutoff):
+        try:
+            # rows are oldest first, so the last one wins
+            vitals[description] = {"value": float(value), "date": pd.Timestamp(date).strftime("%Y-%m-%d")}
+        except (TypeError, ValueError):
+            continue
+    return {"age": None if pd.isna(age) else int(age), "vitals": vitals}
+
+
+def _number(value):
+    """`value` as a finite float, or None."""
+    if isinstance(value, bool):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+
+def clean_facts(facts):
+    """Coerce facts (e.g. sent by a client) into the shape evaluate() expects.
+
+    Raises ValueError if `facts` or its "vitals" is not an object. A reading
+    without a numeric value or with an unparseable date is dropped; an age
+    that is not a number becomes None, so age-limited rules do not fire.
+    """
+    if not isinstance(facts, dict):
+        raise ValueError("facts must be an object")
+    vitals = facts.get("vitals") or {}
+    if not isinstance(vitals, dict):
+        raise ValueError("facts.vitals must be an object")
+    clean = {}
+    for name, reading in vitals.items():
+        if not isinstance(reading, dict):
+            continue
+        value = _number(reading.get("value"))
+        if value is None:
+            continue
+        date = reading.get("date")
+        if date is not None:
+            try:
+                date = pd.Timestamp(date).strftime("%Y-%m-%d")
+            except (TypeError, ValueError):
+                continue
+        clean[str(name)] = {"value": value, "date": date}
+    return {"age": _number(facts.get("age")), "vitals": clean}
+
+
+def _format(value):
+    return f"{value:g}"
+
+
+class RuleEngine:
+    def __init__(self, rules=(), critical_score=CRITICAL_SCORE, max_age_days=MAX_AGE_DAYS):
+        self.rules = []
+        for rule in rules:
+            if rule.get("severity") not in SEVERITIES:
+                raise ValueError(f"Rule {rule.get('name')!r}: severity must be one of {SEVERITIES}")
+            if "above" not in rule and "below" not in rule:
+                raise ValueError(f"Rule {rule.get('name')!r} needs an 'above' or 'below' threshold")
+            self.rules.append(dict(rule, name=rule.get("name") or rule["vital"],
+                                   max_age_days=rule.get("max_age_days", max_age_days)))
+        self.critical_score = critical_score
+
+    @classmethod
+    def from_yaml(cls, path=CONFIG_PATH):
+        """Load rules from `path`; a missing or empty file gives an engine with no rules."""
+        try:
+            with open(path) as f:
+                config = yaml.safe_load(f) or {}
+        except FileNotFoundError:
+            config = {}
+        return cls(config.get("rules") or [], config.get("critical_score", CRITICAL_SCORE),
+                   config.get("max_age_days", MAX_AGE_DAYS))
+
+    def evaluate(self, facts, now=None):
+        """Findings for `facts` (see patient_facts) and the overall severity and score.
+
+        Findings on readings older than their rule's `max_age_days` (or
+        undated) are returned under "stale" and count towards neither.
+        """
+        facts = clean_facts(facts) if facts else {}
+        now = pd.Timestamp(now) if now is not None else pd.Timestamp.now()
+        findings, stale = [], []
+        age = facts.get("age")
+        vitals = facts.get("vitals") or {}
+        for rule in self.rules:
+            reading = vitals.get(rule["vital"])
+            if not reading or reading.get("value") is None:
+                continue
+            if "min_age" in rule and (age is None or age < rule["min_age"]):
+                continue
+            value = reading["value"]
+            if "above" in rule and value > rule["above"]:
+                bound = f"> {_format(rule['above'])}"
+            elif "below" in rule and value < rule["below"]:
+                bound = f"< {_format(rule['below'])}"
+            else:
+                continue
+            date = reading.get("date")
+            days_old = (now - pd.Timestamp(date)).days if date else None
+            finding = {
+                "rule": rule["name"], "vital": rule["vital"], "value": value,
+                "date": date, "days_old": days_old,
+                "severity": rule["severity"], "score": int(rule.get("score", 0)),
+                "text": f"{rule['name']}: {rule['vital']} {_format(value)} {bound}"
+                        + (f" on {date}" if date else ""),
+            }
+            if days_old is None or days_old > rule["max_age_days"]:
+                stale.append(finding)
+            else:
+                findings.append(finding)
+        severity = None
+        for level in SEVERITIES:
+            if any(f["severity"] == level for f in findings):
+                severity = level
+        return {"severity": severity, "score": max((f["score"] for f in findings), default=0),
+                "findings": findings, "stale": stale}
+
+    def fast_verdict(self, assessment):
+        """Verdict for a critical assessment, without asking the model."""
+        critical = [f for f in assessment["findings"] if f["severity"] == "critical"]
+        return self.label({
+            "emergency_index": assessment["score"],
+            "priority_label": "critical",
+            "rationale": "Vitals rule: " + "; ".join(f["text"] for f in critical),
+            "fast_path": True,
+        })
+
+    def raise_to_floor(self, verdict, assessment):
+        """Raise a model verdict's score to the floor set by the rules that fired."""
+        if not assessment or not assessment["severity"] or verdict["emergency_index"] >= assessment["score"]:
+            return verdict
+        note = "raised by vitals rule: " + "; ".join(f["text"] for f in assessment["findings"])
+        return dict(verdict, emergency_index=assessment["score"],
+                    rationale=f"{verdict.get('rationale', '')} ({note})".strip())
+
+    def label(self, verdict):
+        """Label any verdict scoring above `critical_score` as critical."""
+        if int(verdict.get("emergency_index", 0)) > self.critical_score:
+            verdict = dict(verdict, priority_label="critical")
+        return verdict
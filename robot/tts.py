@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""Text-to-speech with an on-disk clip cache and asynchronous playback.
+
+Speaker renders text to a WAV through an engine (espeak or macOS `say`) on
+one thread and plays finished clips in order on another, so `say()` returns
+immediately and the next sentence renders while the current one plays.
+On Linux the clips are written as raw PCM into one long-lived `aplay`, so
+playing a sentence does not start a process; macOS uses `afplay` per clip.
+Fixed and templated phrases are cached under `.tts_cache/`, keyed by
+engine, voice and text, so after the first time they only cost playback;
+one-off sentences (e.g. streamed LLM questions) use temporary files.
+
+Tests can pass NullEngine and NullSink to run the pipeline without audio.
+
+Pre-render the fixed phrases and every patient's greeting with:
+
+    python tts.py
+"""
+import hashlib, os, platform, queue, subprocess, tempfile, threading, time, wave
+from shutil import which
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".tts_cache")
+
+# What the robot always says, and the templates it fills in per patient
+READY = "Triage system ready. Waiting for a patient."
+GOODBYE = "Thank you. I will continue rounds now."
+GREETING = "Hello {name}. I will use your record for this session."
+SCORE = "Your triage score is {score}. Priority {priority}."
+FIXED_PHRASES = [READY, GOODBYE]
+
+
+class EspeakEngine:
+    def __init__(self, voice=None, command="espeak"):
+        self.name = command
+        self.voice = voice
+        self.command = command
+
+    def render(self, text, path):
+        voice = ["-v", self.voice] if self.voice else []
+        subprocess.run([self.command, "-w", path] + voice + [text], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class MacSayEngine:
+    name = "say"
+
+    def __init__(self, voice=None):
+        self.voice = voice
+
+    def render(self, text, path):
+        voice = ["-v", self.voice] if self.voice else []
+        subprocess.run(["say", "-o", path, "--data-format=LEI16@22050"] + voice + [text],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class NullEngine:
+    """Renders every phrase as a short silent clip."""
+    name = "null"
+    voice = None
+
+    def render(self, text, path):
+        with wave.open(path, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(16000)
+            f.writeframes(b"\0\0" * 160)
+
+
+def default_engine(voice=None):
+    if platform.system() == "Darwin":
+        return MacSayEngine(voice)
+    for command in ("espeak", "espeak-ng"):
+        if which(command):
+            return EspeakEngine(voice, command)
+    return None
+
+
+class CommandPlayer:
+    """Plays WAV files with afplay (macOS) or aplay."""
+
+    def __init__(self):
+        if platform.system() == "Darwin":
+            self.command = ["afplay"]
+        elif which("aplay"):
+            self.command = ["aplay", "-q"]
+        else:
+            self.command = None
+
+    def play(self, path):
+        if self.command is None:
+            return
+        subprocess.run(self.command + [path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class StreamPlayer:
+    """Keeps one `aplay` open and writes each clip's PCM frames to its stdin.
+
+    aplay is restarted only if it exits or a clip has a different sample
+    format. play() returns once the clip has had time to play, so waiting
+    on the Speaker still means the robot has finished talking.
+    """
+    FORMATS = {1: "U8", 2: "S16_LE", 4: "S32_LE"}
+
+    def __init__(self, command="aplay"):
+        self.command = command if which(command) else None
+        self._proc = None
+        self._format = None
+        self._busy_until = 0.0
+
+    def _open(self, channels, width, rate):
+        self._proc = subprocess.Popen(
+            [self.command, "-q", "-t", "raw", "-f", self.FORMATS[width], "-r", str(rate), "-c", str(channels)],
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self._format = (channels, width, rate)
+        self._busy_until = 0.0
+
+    def play(self, path):
+        if self.command is None:
+            return
+        with wave.open(path, "rb") as f:
+            channels, width, rate = f.getnchannels(), f.getsampwidth(), f.getframerate()
+            frames = f.readframes(f.getnframes())
+        if self._proc is None or self._proc.poll() is not None or self._format != (channels, width, rate):
+            self.close()
+            self._open(channels, width, rate)
+        try:
+            self._proc.stdin.write(frames)
+            self._proc.stdin.flush()
+        except (BrokenPipeError, OSError):
+            self.close()
+            raise
+        # the write returns once aplay has buffered the clip, not when it has been heard
+        now = time.monotonic()
+        self._busy_until = max(now, self._busy_until) + len(frames) / (channels * width * rate)
+        time.sleep(self._busy_until - now)
+
+    def close(self):
+        if self._proc is not None:
+            try:
+                self._proc.stdin.close()
+            except OSError:
+                pass
+            self._proc.wait()
+            self._proc = None
+
+
+def default_player():
+    if platform.system() != "Darwin" and which("aplay"):
+        return StreamPlayer()
+    return CommandPlayer()
+
+
+class NullSink:
+    """Records what would have been played."""
+
+    def __init__(self):
+        self.played = []
+
+    def play(self, path):
+        self.played.append(path)
+
+
+class Speaker:
+    def __init__(self, engine=None, player=None, cache_dir=CACHE_DIR):
+        self.engine = engine if engine is not None else default_engine()
+        self.player = player if player is not None else default_player()
+        self.cache_dir = cache_dir
+        self.metrics = {"rendered": 0, "cache_hits": 0, "played": 0, "failed": 0}
+        self._render_queue = queue.Queue()
+        self._play_queue = queue.Queue()
+        threading.Thread(target=self._render_loop, daemon=True).start()
+        threading.Thread(target=self._play_loop, daemon=True).start()
+
+    def clip_path(self, text):
+        key = hashlib.sha1(f"{self.engine.name}|{self.engine.voice}|{text}".encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.wav")
+
+    def render(self, text, cache=True):
+        """Return a WAV path for `text`, rendering it unless it is already cached.
+
+        Uncached clips are temporary files that the player deletes after use.
+        """
+        if cache:
+            path = self.clip_path(text)
+            if os.path.exists(path):
+                self.metrics["cache_hits"] += 1
+                return path
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(suffix=".wav", dir=self.cache_dir)
+        else:
+            fd, tmp = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        try:
+            self.engine.render(text, tmp)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self.metrics["rendered"] += 1
+        if not cache:
+            return tmp
+        # atomic, so a concurrent prerender of the same phrase is harmless
+        os.replace(tmp, path)
+        return path
+
+    def prerender(self, phrases):
+        """Render `phrases` into the cache ahead of time (call from a background thread)."""
+        if self.engine is None:
+            return
+        for text in phrases:
+            if text:
+                try:
+                    self.render(text)
+                except Exception as e:
+                    print(f"[TTS] Could not pre-render {text!r}: {e}")
+
+    def say(self, text, cache=True):
+        """Queue `text` for speaking and return at once."""
+        if text:
+            self._render_queue.put((text, cache))
+
+    def wait(self):
+        """Block until everything queued so far has been spoken."""
+        self._render_queue.join()
+        self._play_queue.join()
+
+    def _render_loop(self):
+        while True:
+            text, cache = self._render_queue.get()
+            try:
+                if self.engine is None:
+                    print(f"[TTS skipped] {text}")
+                    continue
+                self._play_queue.put((self.render(text, cache), cache))
+            except Exception:
+                self.metrics["failed"] += 1
+                print(f"[TTS skipped] {text}")
+            finally:
+                self._render_queue.task_done()
+
+    def _play_loop(self):
+        while True:
+            path, cached = self._play_queue.get()
+            try:
+                self.player.play(path)
+                self.metrics["played"] += 1
+            except Exception as e:
+                self.metrics["failed"] += 1
+                print("[TTS] Playback failed:", e)
+            finally:
+                if not cached and os.path.exists(path):
+                    os.remove(path)
+                self._play_queue.task_done()
+
+
+def main():
+    import ehr_parser
+    speaker = Speaker()
+    if speaker.engine is None:
+        print("[TTS] No speech engine found")
+        return
+    names = [ehr_parser.get_full_name(row) for _, row in ehr_parser.loader.patients.iterrows()]
+    speaker.prerender(FIXED_PHRASES + [GREETING.format(name=name) for name in names])
+    print("[TTS]", speaker.metrics)
+
+
+if __name__ == "__main__":
+    main()